@@ -1,72 +1,97 @@
 import os
-import re
+import shutil
 import subprocess
+import tempfile
 import pathlib
-from typing import Iterator
+import queue
+import statistics
+import threading
+from typing import Iterator, Optional
 
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from mutagen.easyid3 import EasyID3
 from mutagen.flac import FLAC
+from mutagen.mp3 import MP3
 
 from database import DB
+import devices
+import features
 from user_types import MetaDict
 from awesome_progress_bar import ProgressBar
 
 
-bpm_pattern = re.compile(r"(\d+|\d+\.\d+) BPM$")
-time_pattern = re.compile(r"(\d+\.\d+)")
+# Fast BPM estimation: number and duration in seconds of the analysed windows.
+BPM_WINDOWS = 3
+BPM_WINDOW_LENGTH = 30
 
 
-def extract_pattern(output: str, pattern) -> int:
-    """Transforms a string representing a float to an int."""
-    match = pattern.search(output)
-
-    try:
-        if match:
-            return round(float(match.group(1)))
-    except ValueError:
-        raise ValueError()
-    return 0
-
-
-def extract_bpm(path: str) -> str:
-    """Executes `bpm-tag` program to extract BPM information."""
-    out = subprocess.Popen(
-        [
-            "bpm-tag",
-            "-n",
-            path,
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    stdout, _ = out.communicate()
-    try:
-        return extract_pattern(stdout.decode("utf-8"), bpm_pattern)
-    except ValueError:
-        print("ERROR BPM")
-        print(path)
-
-
-def extract_length(path: str) -> float:
-    result = subprocess.run(
+def extract_bpm_window(path: str, start: float, duration: float) -> float:
+    """Estimates the BPM of `duration` seconds of audio from `start`. Only this
+    window is decoded, `ffmpeg` seeks to it."""
+    decoder = subprocess.Popen(
         [
-            "ffprobe",
+            "ffmpeg",
             "-v",
             "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
+            "-ss",
+            str(start),
+            "-t",
+            str(duration),
+            "-i",
             path,
+            "-f",
+            "f32le",
+            "-ac",
+            "1",
+            "-ar",
+            "44100",
+            "-",
         ],
         stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
+        stderr=subprocess.DEVNULL,
     )
+    result = subprocess.run(
+        ["bpm"], stdin=decoder.stdout, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    decoder.stdout.close()
+    decoder.wait()
+
     try:
-        return extract_pattern(result.stdout.decode("utf-8"), time_pattern)
+        return float(result.stdout.decode("utf-8").strip())
     except ValueError:
-        print("ERROR Length")
-        print(path)
+        return 0
+
+
+def estimate_bpm(path: str, length: int) -> tuple[int, float]:
+    """Estimates the BPM from a few windows spread over the track.
+
+    Returns the BPM and a confidence, the share of windows agreeing on it
+    (half and double tempo agree)."""
+    if length is None or length <= BPM_WINDOWS * BPM_WINDOW_LENGTH:
+        f = features.analyse(path, ["tempo"])
+        return f.get("bpm"), f.get("bpm_confidence", 0.0)
+
+    estimates = []
+    for i in range(BPM_WINDOWS):
+        start = length * (i + 1) / (BPM_WINDOWS + 1) - BPM_WINDOW_LENGTH / 2
+        bpm = extract_bpm_window(path, start, BPM_WINDOW_LENGTH)
+        if bpm > 0:
+            estimates.append(bpm)
+
+    if len(estimates) == 0:
+        return None, 0.0
+
+    def agreeing(reference: float) -> list[float]:
+        folded = [
+            min((e, e * 2, e / 2), key=lambda x: abs(x - reference)) for e in estimates
+        ]
+        return [e for e in folded if abs(e - reference) <= reference * 0.02]
+
+    # The reference is the estimate most others agree with. The median of an
+    # even number of estimates may agree with none of them.
+    best = max((agreeing(e) for e in estimates), key=len)
+
+    return round(statistics.mean(best)), len(best) / BPM_WINDOWS
 
 
 def date2year(date: str) -> int:
@@ -117,7 +142,8 @@ LABELS = [
 
 
 def meta(path: str) -> MetaDict:
-    """Extract meta of a file of path `path` to a dict."""
+    """Extract meta of a file of path `path` to a dict. Only the tags are
+    read, a missing BPM is left to `backfill_bpm`."""
     meta = {"path": path}
     m = None
 
@@ -139,7 +165,7 @@ def meta(path: str) -> MetaDict:
         del meta["originalyear"]
 
     elif path.endswith(".mp3"):
-        m = EasyID3(path)
+        m = MP3(path, ID3=EasyID3)
 
         for name, func in LABELS + [("originaldate", date2year), ('date', date2year)]:
             if name in m and m[name] is not None and m[name] != []:
@@ -162,68 +188,419 @@ def meta(path: str) -> MetaDict:
     else:
         return meta
 
-    if meta["bpm"] is None:
-        meta["bpm"] = extract_bpm(path)
-
-    meta["length"] = extract_length(path)
+    meta["length"] = round(m.info.length)
+    meta["bpm_confidence"] = None if meta["bpm"] is None else 1.0
 
     return meta
 
 
-def walk_path(
-    path: str, file_extentions: list[str] = [".mp3", ".flac"]
-) -> Iterator[str]:
-    for (dirpath, _, filenames) in os.walk(path):
-        for filename in filenames:
-            for ext in file_extentions:
-                if filename.endswith(ext):
-                    yield os.path.join(dirpath, filename)
-                    break
+def analyse_track(
+    path: str, length: int, fast_bpm: bool = False, tempo: bool = True
+) -> tuple[int, float, dict]:
+    """Returns the BPM of a file, its confidence and its other features, all
+    from a single decode. With `fast_bpm`, only the BPM is estimated from a
+    few windows of the track. Without `tempo`, the BPM is not analysed."""
+    if fast_bpm:
+        return (*estimate_bpm(path, length), {})
+
+    names = [name for name in features.EXTRACTORS if tempo or name != "tempo"]
+    f = features.analyse(path, names)
+    return f.pop("bpm", None), f.pop("bpm_confidence", 0.0), f
+
 
+def list_dir(
+    path: str, file_extentions: frozenset[str]
+) -> tuple[list[str], list[str]]:
+    """Returns the music files, in inode order, and the subdirectories of a
+    directory."""
+    files = []
+    subdirs = []
 
-def count_files(path: str, file_extentions: list[str] = [".mp3", ".flac"]):
-    return sum(1 for _ in walk_path(path, file_extentions))
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1] in file_extentions:
+                    files.append((entry.inode(), entry.path))
+    except OSError:
+        pass
+
+    return [p for _, p in sorted(files)], subdirs
+
+
+def dir_iter(
+    paths: list[str],
+    file_extentions: list[str] = [".mp3", ".flac"],
+    scheduler: Optional[devices.DeviceScheduler] = None,
+) -> Iterator[tuple[str, list[str]]]:
+    """Yields every directory under `paths` with its music files, as soon as
+    it is listed. Directories are listed on the workers of their device, see
+    `devices`, ahead of the consumer and in no particular order. Listings
+    share the workers of `scheduler` if given."""
+    if len(paths) == 0:
+        return
+
+    extentions = frozenset(file_extentions)
+    found = queue.Queue()
+    pending = [len(paths)]
+    lock = threading.Lock()
+    stopped = threading.Event()
+    shared = scheduler is not None
+    if not shared:
+        scheduler = devices.DeviceScheduler()
+
+    def done() -> None:
+        with lock:
+            pending[0] -= 1
+            if pending[0] == 0:
+                found.put(None)
+
+    def cancelled(future: Future) -> None:
+        if future.cancelled():
+            done()
+
+    def submit(directory: str) -> None:
+        try:
+            scheduler.submit(directory, walk, directory).add_done_callback(cancelled)
+        except OSError:
+            done()
 
+    def walk(directory: str) -> None:
+        try:
+            files, subdirs = list_dir(directory, extentions)
+            if not stopped.is_set():
+                with lock:
+                    pending[0] += len(subdirs)
+                for d in subdirs:
+                    submit(d)
+            found.put((directory, files))
+        finally:
+            done()
+
+    for path in paths:
+        submit(path)
 
-def meta_iter(path: str, check_exists=True, progress_bar=True) -> Iterator[MetaDict]:
+    try:
+        while (e := found.get()) is not None:
+            yield e
+    finally:
+        stopped.set()
+        if not shared:
+            scheduler.shutdown()
+
+
+def read_dir(
+    files: list[str], check_exists: bool = True
+) -> list[tuple[str, Optional[MetaDict]]]:
+    """Returns `(path, meta)` of the files of a directory. With
+    `check_exists`, the meta of files already imported is `None`."""
+    return [
+        (p, meta(p) if not check_exists or not DB.path_exists(p) else None)
+        for p in files
+    ]
+
+
+def meta_iter(
+    paths: list[str],
+    check_exists=True,
+    progress_bar=True,
+    skip_dirs: set[str] = set(),
+) -> Iterator[tuple[str, Optional[MetaDict]]]:
+    """Yields `(directory, meta)` for every file to import, then
+    `(directory, None)` once the directory is done. Directories in
+    `skip_dirs` are not scanned.
+
+    Directories are listed and their files read on the workers of their
+    device, see `devices`. Directories are yielded as they are read, those
+    of a fast device do not wait behind those of a slow one."""
 
     if progress_bar:
-        file_count = count_files(path)
-        bar = ProgressBar(file_count, "Scanning", use_eta=True)
-
+        # The total grows as directories are found. It is kept ahead of the
+        # iterations until the walk ends, the bar stops when they are equal.
+        bar = ProgressBar(1, "Scanning", use_eta=True)
+        file_count = 0
+
+    scheduler = devices.DeviceScheduler()
+    # ("listed", directory, files, submitted) as directories are listed,
+    # ("read", directory, future) as they are read, then None.
+    results = queue.Queue()
+    stopped = threading.Event()
+
+    def dispatch() -> None:
+        walk = dir_iter(paths, scheduler=scheduler)
         try:
-            for p in walk_path(path):
-                txt = f" {pathlib.Path(p).name[:25]}"
-                if not check_exists or check_exists and not DB.path_exists(p):
-                    yield meta(p)
-                bar.iter(txt)
-        except KeyboardInterrupt:
+            for (directory, files) in walk:
+                if stopped.is_set():
+                    break
+
+                submitted = directory not in skip_dirs and len(files) > 0
+                results.put(("listed", directory, files, submitted))
+                if not submitted:
+                    continue
+
+                try:
+                    future = scheduler.submit(directory, read_dir, files, check_exists)
+                except OSError:
+                    # Removed since listed, nothing is left to read.
+                    future = Future()
+                    future.set_result([(p, None) for p in files])
+                future.add_done_callback(
+                    lambda f, d=directory: results.put(("read", d, f))
+                )
+        finally:
+            walk.close()
+            results.put(None)
+
+    dispatcher = threading.Thread(target=dispatch, daemon=True)
+    dispatcher.start()
+
+    listing = True
+    reading = 0
+
+    try:
+        while listing or reading > 0:
+            e = results.get()
+            if e is None:
+                listing = False
+            elif e[0] == "listed":
+                _, directory, files, submitted = e
+                if progress_bar:
+                    file_count += len(files)
+                    bar.total = file_count + 1
+
+                if submitted:
+                    reading += 1
+                    continue
+
+                if progress_bar:
+                    for p in files:
+                        bar.iter(f" {pathlib.Path(p).name[:25]}")
+                if directory not in skip_dirs:
+                    yield directory, None
+            else:
+                _, directory, future = e
+                reading -= 1
+
+                for p, m in future.result():
+                    if m is not None:
+                        yield directory, m
+                    if progress_bar:
+                        bar.iter(f" {pathlib.Path(p).name[:25]}")
+
+                yield directory, None
+    except BaseException:
+        if progress_bar:
             bar.stop()
-        bar.wait()
+        raise
+    finally:
+        stopped.set()
+        scheduler.shutdown()
 
-    else:
-        for p in walk_path(path):
-            if not check_exists or check_exists and not DB.path_exists(p):
-                yield meta(p)
+    if progress_bar:
+        if file_count == 0:
+            bar.stop()
+        else:
+            bar.total = file_count
+            bar.wait()
+
+
+def scan_paths(paths: list[str], *args, resume: bool = False, **kargs) -> None:
+    """Imports the files under `paths`. Progress is journaled per directory
+    so an interrupted scan can continue with `resume`."""
+    # Entries staged by an interrupted scan are already analysed.
+    DB.commit_import()
 
+    if resume:
+        done = DB.scanned_directories()
+    else:
+        DB.clear_scan_journal()
+        done = set()
 
-def scan_path(path: str, *args, **kargs) -> None:
     count = 0
     entries = []
 
-    for m in meta_iter(path, *args, **kargs):
-        entries.append(m)
-        count += 1
-        if count % 10 == 0:
-            DB.add_entries(entries)
-            entries = []
+    metas = meta_iter([os.fspath(p) for p in paths], *args, skip_dirs=done, **kargs)
 
-        if count >= 50:
-            DB.commit_import()
-            count = 0
+    try:
+        for (directory, m) in metas:
+            if m is None:
+                DB.add_entries(entries, directory)
+                entries = []
+                continue
+
+            entries.append(m)
+            count += 1
+            if len(entries) >= 10:
+                DB.add_entries(entries)
+                entries = []
+
+            if count >= 50:
+                DB.commit_import()
+                count = 0
+    except KeyboardInterrupt:
+        DB.add_entries(entries)
+        DB.commit_import()
+        print("Scan interrupted, continue it with --resume")
+        return
+    finally:
+        metas.close()
 
     DB.add_entries(entries)
     DB.commit_import()
+    DB.clear_scan_journal()
+
+
+def drain_queue(
+    queue: list[tuple[int, str, int]],
+    fast_bpm: bool = False,
+    tempo: bool = True,
+    jobs: int = 1,
+    progress_bar: bool = True,
+    batch_size: int = 20,
+) -> None:
+    """Analyses `(id, path, length)` tracks with `jobs` workers. Without
+    `tempo`, the BPM is left as is and only the other features are analysed.
+    Results are written to the library in batches."""
+    if len(queue) == 0:
+        return
+
+    if progress_bar:
+        bar = ProgressBar(len(queue), "Analysing", use_eta=True)
+
+    updates = []
+    feature_updates = []
+
+    def store() -> None:
+        if tempo:
+            DB.update_bpms(updates, feature_updates, estimated=fast_bpm)
+        else:
+            DB.update_features(feature_updates)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(analyse_track, p, length, fast_bpm, tempo): (col_id, p)
+            for col_id, p, length in queue
+        }
+
+        try:
+            for future in as_completed(futures):
+                col_id, p = futures[future]
+                try:
+                    bpm, confidence, f = future.result()
+                    updates.append((col_id, bpm, confidence))
+                    feature_updates.append((col_id, f))
+                except Exception:
+                    # The track stays queued for the next run.
+                    print("ERROR Analysis")
+                    print(p)
+
+                if len(updates) >= batch_size:
+                    store()
+                    updates = []
+                    feature_updates = []
+
+                if progress_bar:
+                    bar.iter(f" {pathlib.Path(p).name[:25]}")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            if progress_bar:
+                bar.stop()
+            progress_bar = False
+        finally:
+            store()
+
+    if progress_bar:
+        bar.wait()
+
+
+def backfill_bpm(**kargs) -> None:
+    """Analyses the tracks imported without a BPM tag."""
+    drain_queue(DB.backfill_queue(), **kargs)
+
+
+def refine_bpm(**kargs) -> None:
+    """Runs a full BPM analysis of the tracks whose estimate is not reliable."""
+    drain_queue(DB.refine_queue(), fast_bpm=False, **kargs)
+
+
+def analyse_features(**kargs) -> None:
+    """Analyses the loudness and energy of the tracks missing them, such as
+    those imported with a BPM tag."""
+    drain_queue(DB.feature_queue(), fast_bpm=False, tempo=False, **kargs)
+
+
+def write_bpm_tag(path: str, bpm: int) -> None:
+    """Writes `bpm` to the tags of a file. The tags are written to a copy which
+    then replaces the file, so an interrupted write never corrupts it."""
+    directory, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{name}.", dir=directory)
+    os.close(fd)
+
+    try:
+        shutil.copy2(path, tmp)
+
+        if path.endswith(".flac"):
+            m = FLAC(tmp)
+        else:
+            m = MP3(tmp, ID3=EasyID3)
+            if m.tags is None:
+                m.add_tags()
+
+        m["bpm"] = str(bpm)
+        m.save()
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def write_tags(jobs: int = 1, progress_bar: bool = True, batch_size: int = 20) -> None:
+    """Writes analysed BPMs back to the files, so the next scans read them
+    from the tags."""
+    queue = DB.tag_queue()
+    if len(queue) == 0:
+        return
+
+    if progress_bar:
+        bar = ProgressBar(len(queue), "Tagging", use_eta=True)
+
+    written = []
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(write_bpm_tag, p, bpm): (col_id, p)
+            for col_id, p, bpm in queue
+        }
+
+        try:
+            for future in as_completed(futures):
+                col_id, p = futures[future]
+                try:
+                    future.result()
+                    written.append(col_id)
+                except Exception:
+                    print("ERROR Tags")
+                    print(p)
+
+                if len(written) >= batch_size:
+                    DB.tags_written(written)
+                    written = []
+
+                if progress_bar:
+                    bar.iter(f" {pathlib.Path(p).name[:25]}")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            if progress_bar:
+                bar.stop()
+            progress_bar = False
+
+    DB.tags_written(written)
+
+    if progress_bar:
+        bar.wait()
 
 
 def verify_integrity(progress_bar=True) -> None:
@@ -236,8 +613,8 @@ def verify_integrity(progress_bar=True) -> None:
         try:
             for p in DB.paths():
                 txt = f" {pathlib.Path(p).name[:25]}"
-                if not pathlib.Path(p).exists:
-                    DB.delete_entry(p)
+                if not pathlib.Path(p).exists():
+                    DB.delete_entry(path=p)
                 bar.iter(txt)
         except KeyboardInterrupt:
             bar.stop()
@@ -245,5 +622,5 @@ def verify_integrity(progress_bar=True) -> None:
 
     else:
         for p in DB.paths():
-            if not pathlib.Path(p).exists:
-                DB.delete_entry(p)
+            if not pathlib.Path(p).exists():
+                DB.delete_entry(path=p)
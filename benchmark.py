@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Peak memory and time of reading a large result set, materialized as
+lists of dicts or streamed, on the current library.
+
+    python benchmark.py [--repeat N] [--batch-size ROWS]
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable
+
+from database import DB
+from playlist import Creator, Track
+
+
+def materialized(query) -> int:
+    """Former path: a list of dicts, then a Track per dict."""
+    return len([Track(**args) for args in DB.query(query)])
+
+
+def streamed_tracks(query, batch_size: int) -> int:
+    """Tracks built from the cursor batches, as `generate_playlist` does."""
+    return len(list(DB.iter_query(query, Track.from_row, batch_size=batch_size)))
+
+
+def streamed_rows(query, batch_size: int) -> int:
+    """Rows consumed as they are fetched, nothing kept."""
+    n = 0
+    for _ in DB.iter_query(query, batch_size=batch_size):
+        n += 1
+    return n
+
+
+def measure(f: Callable[[], int], repeat: int) -> tuple[int, float, int]:
+    """Returns the rows read, the best time in seconds and the peak of
+    allocated memory in bytes."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = f()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return rows, min(times), peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=512)
+    args = parser.parse_args()
+
+    query = Creator().query
+    cases = [
+        ("dicts", lambda: materialized(query)),
+        ("tracks", lambda: streamed_tracks(query, args.batch_size)),
+        ("rows", lambda: streamed_rows(query, args.batch_size)),
+    ]
+
+    print(f"{'case':<8} {'rows':>8} {'time':>10} {'peak':>10}")
+    for name, f in cases:
+        rows, seconds, peak = measure(f, args.repeat)
+        print(f"{name:<8} {rows:>8} {seconds * 1000:>8.1f}ms {peak / 2**20:>8.1f}MB")
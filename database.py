@@ -1,12 +1,17 @@
 import sqlite3
 import os
+import queue
+import random
 import pathlib
 import sys
+import threading
+from contextlib import contextmanager
 from query import Query, QueryColumn
 
 from xdg import xdg_config_home
-from typing import Iterator
+from typing import Any, Callable, Iterator, Optional
 from user_types import MetaDict, MetaValue
+from normalize import duplicate_key, same_length
 
 path = pathlib.Path(os.path.abspath(os.path.dirname(sys.argv[0])))
 sql_path = path.joinpath("sql")
@@ -14,6 +19,35 @@ db_dir = pathlib.Path(xdg_config_home()).joinpath("daifukusan", "bpm_playlist")
 db_path = db_dir.joinpath("database.db")
 db_dir.mkdir(parents=True, exist_ok=True)
 
+# Tracks with a lower BPM confidence are queued for a full analysis.
+REFINE_CONFIDENCE = 0.75
+
+# Seconds a connection waits for a lock held by another one.
+BUSY_TIMEOUT = 30.0
+
+# Rows fetched at a time when streaming query results.
+QUERY_BATCH_SIZE = 512
+
+# Summaries of the library with the number and duration of their tracks.
+# BPMs are counted by buckets of 10.
+FACETS = ["artists", "albumartists", "genres", "years", "bpm"]
+# Value of each facet and the joins from `library` to read it, in `{schema}`.
+FACET_VALUES = {
+    "artists": (
+        "artists.name",
+        """JOIN {schema}.track_artists ON track_artists.library_id = library.id
+JOIN {schema}.artists ON artists.id = track_artists.artist_id""",
+    ),
+    "albumartists": ("library.albumartist", ""),
+    "genres": (
+        "genres.name",
+        """JOIN {schema}.genre_list ON genre_list.library_id = library.id
+JOIN {schema}.genres ON genres.id = genre_list.genre_id""",
+    ),
+    "years": ("library.year", ""),
+    "bpm": ("CAST(library.bpm / 10 AS INTEGER) * 10", ""),
+}
+
 
 class __Database:
     __db_columns = [
@@ -26,14 +60,58 @@ class __Database:
         "artistsort",
         "album",
         "bpm",
+        "bpm_confidence",
         "length",
         "year",
     ]
+    # Columns added after the first release, created on existing databases,
+    # and the query filling them.
+    __db_migrations = [
+        ("library", "bpm_confidence", "REAL", None),
+        ("import", "bpm_confidence", "REAL", None),
+        ("library", "dup_key", "VARCHAR", "update.duplicate_keys"),
+        ("library", "canonical_id", "INTEGER", "update.all_canonical"),
+        ("library", "loudness", "REAL", None),
+        ("library", "replaygain", "REAL", None),
+        ("library", "energy", "REAL", None),
+        ("library", "changed", "INTEGER", "update.all_changed"),
+        ("library", "content_hash", "VARCHAR", None),
+    ]
+    # Columns set by the audio features analysis, besides the BPM.
+    __feature_columns = ["length", "loudness", "replaygain", "energy"]
+    # Tables added after the first release, and the queries filling them
+    # from the library.
+    __db_table_migrations = [
+        (
+            "track_artists",
+            ["function.library.to_artists", "function.library.to_track_artists"],
+        ),
+        ("facets", ["function.library.to_facets"]),
+    ]
 
     def __init__(self):
-        self.__conn = sqlite3.connect(db_path)
+        self.__busy_timeout = BUSY_TIMEOUT
+        # Single writer connection, used by one thread at a time.
+        self.__conn = sqlite3.connect(
+            db_path, timeout=self.__busy_timeout, check_same_thread=False
+        )
+        self.__conn.execute("PRAGMA journal_mode = WAL")
+        self.__conn.execute("PRAGMA synchronous = NORMAL")
+        self.__conn.execute("PRAGMA foreign_keys = ON")
+        self.__conn.create_function(
+            "duplicate_key", 2, duplicate_key, deterministic=True
+        )
+        self.__conn.create_function("same_length", 2, same_length, deterministic=True)
         self.__c = self.__conn.cursor()
+        self.__write_lock = threading.RLock()
+        # Idle read-only connections.
+        self.__readers: queue.SimpleQueue = queue.SimpleQueue()
+        self.__readers_generation = 0
         self.__queries = None
+        self.__sources = ["main"]
+        self.__attached: list[tuple[str, str]] = []
+        self.__version_conn = None
+        self.__version_lock = threading.Lock()
 
         if self.__queries is None:
             self.__queries = {}
@@ -63,26 +141,318 @@ class __Database:
         return p
 
     def __init(self) -> None:
+        with self.__writer():
+            self.__create()
+
+    def __create(self) -> None:
+        tables = self.__tables("main")
         self.__c.execute(self.__queries["create.library"])
         self.__c.execute(self.__queries["create.genres"])
         self.__c.execute(self.__queries["create.import"])
         self.__c.execute(self.__queries["create.genre_list"])
         self.__c.execute(self.__queries["create.genres_concat_view"])
-        self.__conn.commit()
+        self.__c.execute(self.__queries["create.scan_journal"])
+        self.__c.execute(self.__queries["create.refine_queue"])
+        self.__c.execute(self.__queries["create.backfill_queue"])
+        self.__c.execute(self.__queries["create.tag_queue"])
+        self.__c.execute(self.__queries["create.feature_failures"])
+        self.__c.execute(self.__queries["create.artists"])
+        self.__c.execute(self.__queries["create.track_artists"])
+        self.__c.execute(self.__queries["create.track_artists_artist_index"])
+        self.__c.execute(self.__queries["create.facets"])
+        self.__c.execute(self.__queries["create.smart_playlists"])
+        self.__c.execute(self.__queries["create.smart_playlist_tracks"])
+        self.__c.execute(self.__queries["create.smart_playlist_tracks_library_index"])
+        self.__c.execute(self.__queries["drop.library_albumartist_index"])
+        self.__c.execute(self.__queries["create.library_version"])
+        self.__c.execute(self.__queries["insert.library_version"])
+        fills = self.__migrate(tables)
+        self.__c.execute(self.__queries["create.library_dup_key_index"])
+        self.__c.execute(self.__queries["create.library_changed_index"])
+        self.__c.execute(self.__queries["create.library_content_hash_index"])
+        for fill in fills:
+            self.__c.execute(self.__queries[fill])
+        # Keys of earlier versions held a bucket of the length.
+        if self.__c.execute(self.__queries["update.legacy_duplicate_keys"]).rowcount:
+            self.__c.execute(self.__queries["update.all_canonical"])
+        # Rows are stamped with the library version of their last change.
+        self.__c.execute(self.__queries["create.library_changed_insert_trigger"])
+        self.__c.execute(self.__queries["create.library_changed_update_trigger"])
+        # Facets follow every change of the tracks and of their links.
+        self.__c.execute(self.__queries["create.library_facets_insert_trigger"])
+        self.__c.execute(self.__queries["create.library_facets_delete_trigger"])
+        self.__c.execute(self.__queries["create.library_facets_update_trigger"])
+        self.__c.execute(self.__queries["create.genre_list_facets_insert_trigger"])
+        self.__c.execute(self.__queries["create.genre_list_facets_delete_trigger"])
+        self.__c.execute(self.__queries["create.track_artists_facets_insert_trigger"])
+        self.__c.execute(self.__queries["create.track_artists_facets_delete_trigger"])
+
+    @contextmanager
+    def __writer(self) -> Iterator[sqlite3.Cursor]:
+        """Serializes the writes of all threads. The transaction is committed
+        on exit, or rolled back on error."""
+        with self.__write_lock:
+            try:
+                yield self.__c
+            except BaseException:
+                self.__conn.rollback()
+                raise
+            self.__conn.commit()
+
+    @contextmanager
+    def __reader(self) -> Iterator[sqlite3.Cursor]:
+        """Borrows a read-only connection from the pool. Readers keep their
+        page cache and prepared statements between queries, and never wait
+        for the writer."""
+        generation = self.__readers_generation
+        try:
+            conn = self.__readers.get_nowait()
+        except queue.Empty:
+            conn = self.__connect_read_only(check_same_thread=False)
+            conn.execute("PRAGMA cache_size = -65536")
+            conn.execute("PRAGMA mmap_size = 268435456")
+
+        try:
+            yield conn.cursor()
+        finally:
+            if generation == self.__readers_generation:
+                self.__readers.put(conn)
+            else:
+                conn.close()
+
+    def __reset_readers(self) -> None:
+        """Drops the idle readers, new ones are opened with the current
+        settings."""
+        self.__readers_generation += 1
+        while True:
+            try:
+                self.__readers.get_nowait().close()
+            except queue.Empty:
+                break
 
-    def add_entries(self, entries: list[MetaDict]) -> None:
+    def set_busy_timeout(self, seconds: float) -> None:
+        self.__busy_timeout = seconds
+        with self.__writer() as c:
+            c.execute(f"PRAGMA busy_timeout = {int(seconds * 1000)}")
+        self.__reset_readers()
+
+    def __tables(self, schema: str) -> set[str]:
+        return {
+            e[0]
+            for e in self.__c.execute(
+                f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'"
+            )
+        }
+
+    def __migrate(self, tables: set[str]) -> list[str]:
+        """Adds the missing columns and returns the queries filling them, and
+        the new tables. `tables` are the tables existing before the
+        creations."""
+        fills = []
+        if "library" in tables:
+            for table, table_fills in self.__db_table_migrations:
+                if table not in tables:
+                    fills += table_fills
+        for table, column, col_type, fill in self.__db_migrations:
+            columns = [e[1] for e in self.__c.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                self.__c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+                if fill is not None:
+                    fills.append(fill)
+
+        return fills
+
+    def __update_canonical(self, keys: list[str]) -> None:
+        """Points the tracks of each duplicate group to the preferred one."""
         self.__c.executemany(
-            self.__queries["insert.import"], self.__meta_dict_values_iter(entries)
+            self.__queries["update.canonical"], [(k,) for k in keys if k is not None]
         )
-        self.__conn.commit()
+
+    def add_entries(self, entries: list[MetaDict], scanned_dir: str = None) -> None:
+        """Stages entries for import. If `scanned_dir` is given, the directory
+        is recorded as fully scanned in the same transaction."""
+        with self.__writer() as c:
+            c.executemany(
+                self.__queries["insert.import"], self.__meta_dict_values_iter(entries)
+            )
+            if scanned_dir is not None:
+                c.execute(self.__queries["insert.scan_journal"], (scanned_dir,))
 
     def commit_import(self) -> None:
-        self.__c.execute(self.__queries["function.import.to_library"])
-        self.__c.execute(self.__queries["function.import.to_genres"])
-        self.__c.execute(self.__queries["function.import.to_genre_list"])
-        self.__conn.commit()
-        self.__c.execute(self.__queries["truncate.import"])
-        self.__conn.commit()
+        with self.__writer() as c:
+            c.execute(self.__queries["function.import.to_library"])
+            c.execute(self.__queries["function.import.to_genres"])
+            c.execute(self.__queries["function.import.to_genre_list"])
+            c.execute(self.__queries["function.import.to_artists"])
+            c.execute(self.__queries["function.import.to_track_artists"])
+            self.__update_canonical(
+                [
+                    e[0]
+                    for e in c.execute(
+                        self.__queries["query.import_duplicate_keys"]
+                    ).fetchall()
+                ]
+            )
+            c.execute(
+                self.__queries["function.import.to_refine_queue"], (REFINE_CONFIDENCE,)
+            )
+            c.execute(self.__queries["function.import.to_backfill_queue"])
+            c.execute(self.__queries["truncate.import"])
+            c.execute(self.__queries["update.library_version"])
+
+    def refine_queue(self) -> list[tuple[int, str, int]]:
+        """Returns `(id, path, length)` of the tracks waiting for a full BPM
+        analysis."""
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.refine_queue"]).fetchall()
+
+    def backfill_queue(self) -> list[tuple[int, str, int]]:
+        """Returns `(id, path, length)` of the tracks imported without BPM."""
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.backfill_queue"]).fetchall()
+
+    def update_bpms(
+        self,
+        updates: list[tuple[int, int, float]],
+        features: list[tuple[int, dict]] = [],
+        estimated: bool = False,
+    ) -> None:
+        """Stores analysed `(id, bpm, confidence)` and moves the tracks out of
+        the backfill queue. A `None` BPM keeps the current value. Tracks with
+        a low confidence are queued for refinement if their BPM was
+        `estimated` from a few windows, a full analysis leaves the refine
+        queue whatever its result. The others are queued for tag write-back.
+        `features` are the other analysed columns of tracks, stored in the
+        same transaction."""
+        with self.__writer() as cur:
+            cur.executemany(
+                self.__queries["update.bpm"],
+                [{"id": i, "bpm": b, "confidence": c} for i, b, c in updates],
+            )
+            cur.executemany(
+                self.__queries["delete.backfill_queue"], [(i,) for i, _, _ in updates]
+            )
+            cur.executemany(
+                self.__queries["delete.refine_queue"],
+                [
+                    (i,)
+                    for i, _, c in updates
+                    if not estimated or c >= REFINE_CONFIDENCE
+                ],
+            )
+            cur.executemany(
+                self.__queries["insert.refine_queue"],
+                [
+                    (i,)
+                    for i, _, c in updates
+                    if estimated and c < REFINE_CONFIDENCE
+                ],
+            )
+            cur.executemany(
+                self.__queries["insert.tag_queue"],
+                [(i,) for i, b, c in updates if b and c >= REFINE_CONFIDENCE],
+            )
+            self.__update_features(features)
+            cur.execute(self.__queries["update.library_version"])
+
+    def update_features(self, features: list[tuple[int, dict]]) -> None:
+        """Stores `(id, columns)` of analysed features. A `None` value keeps
+        the current one. Tracks still missing their loudness or energy, such
+        as silent or undecodable files, leave the feature queue."""
+        with self.__writer() as c:
+            self.__update_features(features)
+            c.executemany(
+                self.__queries["insert.feature_failures"],
+                [
+                    (i,)
+                    for i, f in features
+                    if f.get("loudness") is None or f.get("energy") is None
+                ],
+            )
+            c.execute(self.__queries["update.library_version"])
+
+    def __update_features(self, features: list[tuple[int, dict]]) -> None:
+        self.__c.executemany(
+            self.__queries["update.features"],
+            [
+                {"id": i, **{col: f.get(col) for col in self.__feature_columns}}
+                for i, f in features
+            ],
+        )
+
+    def feature_queue(self) -> list[tuple[int, str, int]]:
+        """Returns `(id, path, length)` of the tracks whose features are not
+        analysed yet, failed analyses left out."""
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.feature_queue"]).fetchall()
+
+    def tag_queue(self) -> list[tuple[int, str, int]]:
+        """Returns `(id, path, bpm)` of the tracks whose analysed BPM is not
+        written to the file tags yet."""
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.tag_queue"]).fetchall()
+
+    def tags_written(self, col_ids: list[int]) -> None:
+        """The content of the files changed, their hashes are cleared."""
+        with self.__writer() as c:
+            c.executemany(self.__queries["delete.tag_queue"], [(i,) for i in col_ids])
+            c.executemany(
+                self.__queries["update.content_hash"], [(None, i) for i in col_ids]
+            )
+
+    def merge_analysis(self, rows: list[dict]) -> tuple[int, list[dict]]:
+        """Stores analysis rows computed elsewhere. Rows are matched on their
+        `path`, else on their `content_hash`, then merged in a single
+        statement. A `None` value keeps the current one, a BPM without
+        confidence is trusted like a tag. Tracks given a BPM leave the
+        backfill queue. Returns the number of matched rows and the
+        unmatched ones."""
+        with self.__writer() as c:
+            c.execute(self.__queries["create.analysis_import"])
+            c.executemany(self.__queries["insert.analysis_import"], rows)
+            c.execute(self.__queries["update.analysis_import_by_path"])
+            c.execute(self.__queries["update.analysis_import_by_hash"])
+            c.execute(self.__queries["query.analysis_import_unmatched"])
+            names = [e[0] for e in c.description]
+            unmatched = [dict(zip(names, row)) for row in c.fetchall()]
+            matched = len(rows) - len(unmatched)
+
+            c.execute(self.__queries["update.analysis"])
+            c.execute(self.__queries["delete.analysed_backfill_queue"])
+            c.execute(
+                self.__queries["delete.analysed_refine_queue"], (REFINE_CONFIDENCE,)
+            )
+            c.execute(
+                self.__queries["insert.analysed_refine_queue"], (REFINE_CONFIDENCE,)
+            )
+            c.execute(self.__queries["insert.analysed_tag_queue"], (REFINE_CONFIDENCE,))
+            c.execute(self.__queries["truncate.analysis_import"])
+            if matched > 0:
+                c.execute(self.__queries["update.library_version"])
+
+        return matched, unmatched
+
+    def unhashed_tracks(self) -> list[tuple[int, str]]:
+        """Returns `(id, path)` of the tracks without content hash."""
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.unhashed"]).fetchall()
+
+    def set_content_hashes(self, hashes: list[tuple[int, str]]) -> None:
+        with self.__writer() as c:
+            c.executemany(
+                self.__queries["update.content_hash"], [(h, i) for i, h in hashes]
+            )
+
+    def scanned_directories(self) -> set[str]:
+        with self.__reader() as c:
+            return {
+                e[0]
+                for e in c.execute(self.__queries["query.scanned_directories"])
+            }
+
+    def clear_scan_journal(self) -> None:
+        with self.__writer() as c:
+            c.execute(self.__queries["truncate.scan_journal"])
 
     def __meta_dict_values_iter(
         self, meta_dicts: list[MetaDict]
@@ -97,50 +467,364 @@ class __Database:
         return meta
 
     def path_exists(self, path: str) -> bool:
-        return (
-            len(
-                self.__c.execute(
-                    self.__queries["query.path_exists"], (path,)
-                ).fetchall()
+        with self.__reader() as c:
+            return (
+                len(c.execute(self.__queries["query.path_exists"], (path,)).fetchall())
+                > 0
             )
-            > 0
-        )
 
     def count_entries(self) -> int:
-        return self.__c.execute(self.__queries["query.count_entries"]).fetchone()
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.count_entries"]).fetchone()[0]
 
     def paths(self) -> list[str]:
-        return self.__c.execute("SELECT path FROM library").fetchall()
+        with self.__reader() as c:
+            return [e[0] for e in c.execute("SELECT path FROM library")]
 
     def delete_entry(self, col_id: int = None, path: str = None) -> None:
         if col_id is not None:
-            self.__c.execute("DELETE FROM library WHERE id = ?", col_id)
+            where, arg = "id = ?", col_id
         elif path is not None:
-            self.__c.execute("DELETE FROM library WHERE path = ?", path)
+            where, arg = "path = ?", path
+        else:
+            return
 
-    def query(self, query: Query) -> dict:
-        q, args, cols = query.to_query()
+        with self.__writer() as c:
+            keys = c.execute(
+                f"SELECT dup_key FROM library WHERE {where}", (arg,)
+            ).fetchall()
+            c.execute(f"DELETE FROM library WHERE {where}", (arg,))
+            self.__update_canonical([e[0] for e in keys])
+            c.execute(self.__queries["delete.orphan_artists"])
+            c.execute(self.__queries["update.library_version"])
 
-        f = self.__c.execute(q, args).fetchall()
-        elements = []
-        for e in f:
-            d = {}
+    def library_version(self) -> int:
+        """Stamp of the library content, increased by every change."""
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.library_version"]).fetchone()[0]
 
-            for i in range(len(cols)):
-                d[cols[i][0]] = e[i]
+    def snapshot_data(self) -> tuple[int, list[tuple], list[tuple[int, str]]]:
+        """Returns the library version, its tracks and their `(id, genre)`
+        memberships, read in one transaction."""
+        with self.__reader() as c:
+            c.execute("BEGIN")
+            try:
+                version = c.execute(
+                    self.__queries["query.library_version"]
+                ).fetchone()[0]
+                tracks = c.execute(self.__queries["query.snapshot_library"]).fetchall()
+                genres = c.execute(self.__queries["query.snapshot_genres"]).fetchall()
+            finally:
+                c.execute("COMMIT")
 
-            elements.append(d)
+        return version, tracks, genres
 
-        return elements
+    def similarity_data(
+        self, since: int = -1
+    ) -> tuple[int, set[int], list[tuple], list[tuple[int, int]]]:
+        """Returns the library version, the ids of its tracks, the
+        `(id, bpm, year, length, canonical)` of the tracks changed after the
+        `since` version and their `(id, genre id)` memberships, read in one
+        transaction."""
+        with self.__reader() as c:
+            c.execute("BEGIN")
+            try:
+                version = c.execute(
+                    self.__queries["query.library_version"]
+                ).fetchone()[0]
+                ids = {
+                    e[0] for e in c.execute(self.__queries["query.library_ids"])
+                }
+                tracks = c.execute(
+                    self.__queries["query.similarity_library"], (since,)
+                ).fetchall()
+                genres = c.execute(
+                    self.__queries["query.similarity_genres"], (since,)
+                ).fetchall()
+            finally:
+                c.execute("COMMIT")
+
+        return version, ids, tracks, genres
+
+    def changed_ids(self, since: int) -> set[int]:
+        """Ids of the tracks added or changed after the `since` version."""
+        with self.__reader() as c:
+            return {
+                e[0] for e in c.execute(self.__queries["query.changed_ids"], (since,))
+            }
+
+    def save_smart_playlist(self, name: str, spec: str, out: str) -> None:
+        """Stores the JSON `spec` of a smart playlist written to `out`. A
+        playlist of the same name is replaced."""
+        with self.__writer() as c:
+            c.execute(self.__queries["insert.smart_playlist"], (name, spec, out))
+
+    def delete_smart_playlist(self, name: str) -> None:
+        with self.__writer() as c:
+            c.execute(self.__queries["delete.smart_playlist"], (name,))
+
+    def smart_playlists(self) -> list[tuple[int, str, str, str, int, int]]:
+        """Returns `(id, name, spec, out, version, size)` of the smart
+        playlists, `version` being the library version they were last
+        refreshed at."""
+        with self.__reader() as c:
+            return c.execute(self.__queries["query.smart_playlists"]).fetchall()
+
+    def smart_playlist_tracks(self, playlist_id: int) -> list[int]:
+        with self.__reader() as c:
+            return [
+                e[0]
+                for e in c.execute(
+                    self.__queries["query.smart_playlist_tracks"], (playlist_id,)
+                )
+            ]
+
+    def update_smart_playlist(
+        self, playlist_id: int, added: set[int], removed: set[int], version: int
+    ) -> None:
+        """Adds and removes tracks of a smart playlist, now up to date with
+        the library `version`."""
+        with self.__writer() as c:
+            c.executemany(
+                self.__queries["insert.smart_playlist_tracks"],
+                [(playlist_id, i) for i in added],
+            )
+            c.executemany(
+                self.__queries["delete.smart_playlist_tracks"],
+                [(playlist_id, i) for i in removed],
+            )
+            c.execute(self.__queries["update.smart_playlist"], (version, playlist_id))
+
+    def attach(self, path: str) -> str:
+        """Attaches another library database. Queries are then run on every
+        attached database and their results merged."""
+        if not pathlib.Path(path).is_file():
+            raise FileNotFoundError(path)
+
+        name = f"source{len(self.__sources)}"
+        with self.__writer() as c:
+            c.execute(f"ATTACH DATABASE ? AS {name}", (str(path),))
+
+            tables = self.__tables(name)
+            if "library" not in tables:
+                c.execute(f"DETACH DATABASE {name}")
+                raise ValueError(f"{path} is not a library database")
+
+            columns = [e[1] for e in c.execute(f"PRAGMA {name}.table_info(library)")]
+            if any(
+                table == "library" and column not in columns
+                for table, column, _, _ in self.__db_migrations
+            ) or any(table not in tables for table, _ in self.__db_table_migrations):
+                c.execute(f"DETACH DATABASE {name}")
+                raise ValueError(f"{path} is outdated, open it once to upgrade it")
+
+            self.__sources.append(name)
+            self.__attached.append((name, str(path)))
+
+        # Readers opened before see the previous sources only.
+        self.__reset_readers()
+        with self.__version_lock:
+            if self.__version_conn is not None:
+                self.__version_conn.close()
+                self.__version_conn = None
+
+        return name
+
+    def __connect_read_only(self, **kargs) -> sqlite3.Connection:
+        """Opens a read-only connection with every source attached."""
+        conn = sqlite3.connect(
+            pathlib.Path(db_path).absolute().as_uri() + "?mode=ro",
+            uri=True,
+            timeout=self.__busy_timeout,
+            **kargs,
+        )
+
+        for name, p in self.__attached:
+            conn.execute(
+                f"ATTACH DATABASE ? AS {name}",
+                (pathlib.Path(p).absolute().as_uri() + "?mode=ro",),
+            )
+
+        return conn
+
+    def data_version(self) -> tuple[int, ...]:
+        """Changes every time another connection commits to one of the
+        sources."""
+        with self.__version_lock:
+            if self.__version_conn is None:
+                self.__version_conn = self.__connect_read_only(
+                    check_same_thread=False
+                )
+
+            return tuple(
+                self.__version_conn.execute(
+                    f"PRAGMA {schema}.data_version"
+                ).fetchone()[0]
+                for schema in self.__sources
+            )
+
+    def sources(self) -> list[str]:
+        return list(self.__sources)
+
+    def query(self, query: Query, sources: list[str] = None) -> list[dict]:
+        """Runs `query` on every source, or on `sources`, and merges the
+        results. Tracks found in several sources are only returned once,
+        first source wins."""
+        return list(
+            self.iter_query(query, lambda names, row: dict(zip(names, row)), sources)
+        )
+
+    def iter_query(
+        self,
+        query: Query,
+        row_factory: Callable[[list[str], tuple], Any] = None,
+        sources: list[str] = None,
+        batch_size: int = QUERY_BATCH_SIZE,
+    ) -> Iterator:
+        """Streams the results of `query`, as `DB.query`. Rows are fetched
+        by batches of `batch_size` and yielded as tuples, or as built by
+        `row_factory(column_names, row)`. Merging several sources in random
+        order or up to a limit needs all their rows first."""
+        sources = self.__sources if sources is None else sources
+        rows = self.__iter_sources(query, row_factory, sources, batch_size)
+
+        if len(sources) > 1 and (query.order_by_random or query.limit > 0):
+            rows = list(rows)
+            if query.order_by_random:
+                random.shuffle(rows)
+            if query.limit > 0:
+                rows = rows[: query.limit]
+
+        yield from rows
+
+    def __iter_sources(
+        self,
+        query: Query,
+        row_factory: Optional[Callable[[list[str], tuple], Any]],
+        sources: list[str],
+        batch_size: int,
+    ) -> Iterator:
+        # Paths are unique in a source, only merged sources are deduplicated.
+        seen = set() if len(sources) > 1 else None
+
+        for schema in sources:
+            q, args, cols = query.to_query(None if schema == "main" else schema)
+            names = [name for name, _ in cols]
+            path = names.index("path") if seen is not None and "path" in names else None
+
+            with self.__reader() as c:
+                c.execute(q, args)
+                while batch := c.fetchmany(batch_size):
+                    for row in batch:
+                        if path is not None:
+                            if row[path] in seen:
+                                continue
+                            seen.add(row[path])
+
+                        yield row if row_factory is None else row_factory(names, row)
+
+    def facets(
+        self, facet: str, prefix: str = None, sort: str = "value", limit: int = -1
+    ) -> list[tuple[MetaValue, int, int]]:
+        """Returns `(value, tracks, duration)` of a facet, merged over the
+        sources. A track found in several sources is counted once, like in
+        query results. Values can be filtered by a case-insensitive `prefix`,
+        and sorted by `value` or by decreasing `count`."""
+        if facet not in FACETS:
+            raise KeyError(facet)
+
+        if prefix is not None:
+            for c in "\\%_":
+                prefix = prefix.replace(c, "\\" + c)
+
+        merged: dict[MetaValue, list[int]] = {}
+        for n, schema in enumerate(self.__sources):
+            q = f"SELECT value, tracks, duration FROM {schema}.facets WHERE facet = ?"
+            args = [facet]
+            if prefix is not None:
+                q += " AND value LIKE ? ESCAPE '\\'"
+                args.append(prefix + "%")
+
+            with self.__reader() as c:
+                for value, tracks, duration in c.execute(q, args):
+                    e = merged.setdefault(value, [0, 0])
+                    e[0] += tracks
+                    e[1] += duration
+
+                if n == 0:
+                    continue
+                # Tracks of a previous source are only counted there.
+                for value, tracks, duration in c.execute(
+                    *self.__shadowed_facet(facet, schema, self.__sources[:n], prefix)
+                ):
+                    e = merged.setdefault(value, [0, 0])
+                    e[0] -= tracks
+                    e[1] -= duration
+
+        merged = {value: e for value, e in merged.items() if e[0] > 0}
+
+        facets = [(value, e[0], e[1]) for value, e in merged.items()]
+        if sort == "count":
+            facets.sort(key=lambda e: (-e[1], str(e[0])))
+        else:
+            facets.sort(
+                key=lambda e: (
+                    (1, e[0].casefold()) if isinstance(e[0], str) else (0, e[0])
+                )
+            )
+
+        return facets[:limit] if limit > 0 else facets
+
+    def __shadowed_facet(
+        self, facet: str, schema: str, previous: list[str], prefix: Optional[str]
+    ) -> tuple[str, list]:
+        """Query of `(value, tracks, duration)` of a facet of `schema`, over
+        the tracks whose path is in one of the `previous` sources."""
+        value, joins = FACET_VALUES[facet]
+        shadowed = " OR ".join(
+            f"EXISTS (SELECT 1 FROM {e}.library AS l WHERE l.path = library.path)"
+            for e in previous
+        )
+        q = f"""SELECT {value}, COUNT(*), SUM(COALESCE(library.length, 0))
+FROM {schema}.library
+{joins.format(schema=schema)}
+WHERE {value} IS NOT NULL AND ({shadowed})"""
+        args = []
+        if prefix is not None:
+            q += f" AND {value} LIKE ? ESCAPE '\\'"
+            args.append(prefix + "%")
+
+        return q + f"\nGROUP BY {value}", args
+
+    def explain(self, query: Query) -> list[tuple[str, str, list, list[tuple]]]:
+        """Returns, per source, the SQL of `query`, its arguments and its
+        `EXPLAIN QUERY PLAN` rows `(id, parent, detail)`."""
+        plans = []
+
+        for schema in self.__sources:
+            q, args, _ = query.to_query(None if schema == "main" else schema)
+            with self.__reader() as c:
+                plan = c.execute("EXPLAIN QUERY PLAN " + q, args).fetchall()
+            plans.append((schema, q, args, [(e[0], e[1], e[3]) for e in plan]))
+
+        return plans
 
     def column(self, column: QueryColumn, limit: int = -1):
-        q = f"SELECT DISTINCT {column.real_name()} FROM {column.table}"
-        q += f"\nORDER BY {column.original_name()}"
+        if len(self.__sources) == 1:
+            q = f"SELECT DISTINCT {column.real_name()} FROM {column.table}"
+            q += f"\nORDER BY {column.original_name()}"
+        else:
+            q = "\nUNION\n".join(
+                f"SELECT {column.name} FROM {schema}.{column.table}"
+                for schema in self.__sources
+            )
+            q += "\nORDER BY 1"
 
         if limit > 0:
             q += f" LIMIT {limit}"
 
-        r = self.__c.execute(q).fetchall()
+        with self.__reader() as c:
+            r = c.execute(q).fetchall()
 
         return [e[0] for e in r]
 
@@ -0,0 +1,183 @@
+"""I/O scheduling by storage device.
+
+Work on files is queued on the device holding them, each device with its
+own workers: a slow spinning disk does not hold back an SSD, and threads do
+not make a disk seek back and forth. Rotational disks are read by a single
+worker in inode order, which follows the on-disk layout.
+
+Devices are identified by `st_dev` and recognized from
+`/sys/dev/block/MAJOR:MINOR`. Network file systems (NFS, SMB, sshfs) are
+recognized from their type in `/proc/self/mountinfo` and read concurrently,
+their latency is not the one of a disk head. Other anonymous devices, of
+major 0, such as Btrfs, ZFS or overlayfs mounts, are looked up through the
+block device they are mounted from.
+"""
+import heapq
+import itertools
+import os
+import re
+import stat
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+ROTATIONAL = "rotational"
+SOLID = "solid"
+NETWORK = "network"
+
+# Workers of each kind of device.
+DEVICE_THREADS = {ROTATIONAL: 1, SOLID: 8, NETWORK: 8}
+
+# Mount types of network file systems.
+NETWORK_FSTYPES = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "9p",
+    "afs",
+    "ceph",
+    "glusterfs",
+    "fuse.sshfs",
+    "fuse.rclone",
+    "fuse.s3fs",
+    "fuse.gcsfuse",
+}
+# Mount types held in memory.
+MEMORY_FSTYPES = {"tmpfs", "ramfs"}
+
+
+def mount_of(dev: int) -> tuple[str, str]:
+    """Returns the type and source of the mount of the device `dev`, empty if
+    it is not found."""
+    number = f"{os.major(dev)}:{os.minor(dev)}"
+    try:
+        with open("/proc/self/mountinfo") as f:
+            for line in f:
+                fields = line.split()
+                # Optional fields end with a "-" separator.
+                sep = fields.index("-")
+                if fields[2] == number and len(fields) > sep + 2:
+                    # Spaces and tabs are escaped in octal.
+                    source = re.sub(
+                        r"\\([0-7]{3})", lambda m: chr(int(m[1], 8)), fields[sep + 2]
+                    )
+                    return fields[sep + 1], source
+    except (OSError, ValueError):
+        pass
+
+    return "", ""
+
+
+def device_kind(dev: int) -> str:
+    """Returns the kind of the device `dev`. Devices that cannot be
+    recognized are taken as rotational, read one file at a time."""
+    major, minor = os.major(dev), os.minor(dev)
+    if major == 0:
+        fstype, source = mount_of(dev)
+        if fstype in NETWORK_FSTYPES:
+            return NETWORK
+        if fstype in MEMORY_FSTYPES:
+            return SOLID
+        try:
+            st = os.stat(source)
+        except OSError:
+            return ROTATIONAL
+        if not stat.S_ISBLK(st.st_mode):
+            return ROTATIONAL
+        major, minor = os.major(st.st_rdev), os.minor(st.st_rdev)
+
+    # Partitions have no queue, it is the one of their parent disk.
+    base = os.path.realpath(f"/sys/dev/block/{major}:{minor}")
+    for directory in (base, os.path.dirname(base)):
+        try:
+            with open(os.path.join(directory, "queue", "rotational")) as f:
+                return ROTATIONAL if f.read().strip() == "1" else SOLID
+        except OSError:
+            pass
+
+    return ROTATIONAL
+
+
+class Device:
+    """Queue and workers of one device. Tasks are run by increasing key."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.threads = DEVICE_THREADS[kind]
+        self.tasks: list[tuple] = []
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.workers: list[threading.Thread] = []
+
+    def submit(self, key: int, seq: int, future: Future, fn, args) -> None:
+        with self.condition:
+            heapq.heappush(self.tasks, (key, seq, future, fn, args))
+            if len(self.workers) < min(self.threads, len(self.tasks)):
+                worker = threading.Thread(target=self.__work, daemon=True)
+                self.workers.append(worker)
+                worker.start()
+            self.condition.notify()
+
+    def stop(self) -> None:
+        """Cancels the queued tasks, the running ones are completed."""
+        with self.condition:
+            self.stopped = True
+            for _, _, future, _, _ in self.tasks:
+                future.cancel()
+            self.tasks = []
+            self.condition.notify_all()
+
+    def __work(self) -> None:
+        while True:
+            with self.condition:
+                while len(self.tasks) == 0 and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                _, _, future, fn, args = heapq.heappop(self.tasks)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class DeviceScheduler:
+    """Runs tasks on the workers of the device of their path."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices: dict[int, Device] = {}
+        self.seq = itertools.count()
+        self.stopped = False
+
+    def device(self, dev: int) -> Device:
+        with self.lock:
+            if dev not in self.devices:
+                self.devices[dev] = Device(device_kind(dev))
+            return self.devices[dev]
+
+    def submit(self, path: str, fn: Callable, *args) -> Future:
+        """Queues `fn(*args)`, working on `path`, on the device of `path`.
+        Tasks of rotational devices are run in inode order of their path."""
+        st = os.stat(path)
+        device = self.device(st.st_dev)
+        future = Future()
+        if self.stopped:
+            future.cancel()
+            return future
+
+        key = st.st_ino if device.kind == ROTATIONAL else 0
+        device.submit(key, next(self.seq), future, fn, args)
+        return future
+
+    def shutdown(self) -> None:
+        """Cancels the queued tasks of every device."""
+        with self.lock:
+            self.stopped = True
+            for device in self.devices.values():
+                device.stop()
@@ -1,83 +1,165 @@
 #!/usr/bin/env python
 # PYTHON_ARGCOMPLETE_OK
 import argparse
+import os
 import pathlib
+import sqlite3
 import argcomplete
-from database import DB
-from query import QueryColumn
+from database import DB, FACETS
 import analyse
+import merge
 import playlist
+import server
+import smart
+import snapshot
+
+
+# Playlist options and whether they hold a single value (`nargs=1`).
+PLAYLIST_OPTIONS = {
+    "bpm_min": True,
+    "bpm_max": True,
+    "bpm_range": False,
+    "bpm_window": False,
+    "length_min": True,
+    "length_max": True,
+    "random": False,
+    "seed": True,
+    "artist_cap": True,
+    "weight": True,
+    "similar_to": False,
+    "profile": False,
+    "artist_restrict": False,
+    "artist_exclude": False,
+    "genre_restrict": False,
+    "genre_exclude": False,
+    "time_length": True,
+    "root": True,
+}
+
+
+def profile_segment(s: str) -> tuple[int, int, int]:
+    """Parses a `BPM_MIN-BPM_MAX:MINUTES` profile segment."""
+    try:
+        bpms, minutes = s.split(":")
+        bpm_min, bpm_max = bpms.split("-")
+        return int(bpm_min), int(bpm_max), int(minutes)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid segment {s!r}, expected BPM_MIN-BPM_MAX:MINUTES"
+        )
+
+
+def playlist_spec(args: dict) -> dict:
+    """Converts parsed command line options to a playlist specification."""
+    spec = {}
+
+    for name, single in PLAYLIST_OPTIONS.items():
+        value = args[name]
+        if single and value is not None:
+            value = value[0]
+        if isinstance(value, pathlib.Path):
+            value = str(value)
+        spec[name] = value
+
+    return spec
 
 
 def main(**args):
-    if args["option_list"] is not None:
-        cols = {
-            "artists": QueryColumn(name="artist", table="library"),
-            "albumartists": QueryColumn(name="albumartist", table="library"),
-            "years": None,
-            "bpm": QueryColumn(name="bpm", table="library"),
-            "genres": QueryColumn(name="name", table="genres"),
-        }
+    if args["busy_timeout"] is not None:
+        DB.set_busy_timeout(args["busy_timeout"][0])
 
-        for e in DB.column(cols[args["option_list"][0]]):
-            print(e)
+    if args["option_list"] is not None:
+        for value, tracks, duration in DB.facets(
+            args["option_list"][0],
+            prefix=args["option_prefix"],
+            sort=args["option_sort"],
+        ):
+            if args["option_counts"]:
+                print(f"{value}\t{tracks}\t{playlist.sec_to_hour(duration)}")
+            else:
+                print(value)
 
     if args["sync"] is not None:
-        analyse.scan_path(args["sync"][0])
+        analyse.scan_paths(args["sync"], resume=args["resume"])
+
+    if args["import_analysis"] is not None:
+        try:
+            matched, unmatched = merge.import_analysis(args["import_analysis"][0])
+        except (OSError, ValueError, sqlite3.Error) as e:
+            raise SystemExit(e)
+        if not args["quiet"]:
+            print(f"Imported analysis: {matched} rows matched, {unmatched} unmatched")
+
+    if args["backfill"]:
+        analyse.backfill_bpm(fast_bpm=args["fast_bpm"], jobs=args["jobs"][0])
+
+    if args["refine"]:
+        analyse.refine_bpm(jobs=args["jobs"][0])
+
+    if args["analyse"]:
+        analyse.analyse_features(jobs=args["jobs"][0])
+
+    if args["write_tags"]:
+        analyse.write_tags(jobs=args["jobs"][0])
+
+    if args["save_smart"] is not None:
+        if args["out"] is None:
+            raise SystemExit("--save-smart needs the playlist file, given with -o")
+        try:
+            smart.save(args["save_smart"][0], playlist_spec(args), args["out"][0])
+        except ValueError as e:
+            raise SystemExit(e)
+
+    if args["delete_smart"] is not None:
+        smart.delete(args["delete_smart"][0])
+
+    if (
+        args["refresh_smart"]
+        or args["save_smart"] is not None
+        or args["sync"] is not None
+        or args["import_analysis"] is not None
+        or args["backfill"]
+        or args["refine"]
+        or args["analyse"]
+    ):
+        for name, (added, removed) in smart.refresh().items():
+            if not args["quiet"]:
+                print(f"{name}: +{added} -{removed}")
+        snapshot.refresh()
+
+    if args["snapshot"]:
+        snapshot.export()
+
+    if args["serve"] is not None:
+        host, _, port = args["serve"].rpartition(":")
+        server.serve(host or "127.0.0.1", int(port))
 
     if args["playlist"]:
-        creator = playlist.Creator()
-
-        if args["bpm_min"] is not None or args["bpm_max"] is not None:
-            if args["bpm_min"] is not None:
-                creator = creator.with_bpm_lower_bound(args["bpm_min"][0])
-            if args["bpm_max"] is not None:
-                creator = creator.with_bpm_upper_bound(args["bpm_max"][0])
-        else:
-            if args["bpm_range"] is not None:
-                creator = creator.with_bpm_bounds(
-                    args["bpm_range"][0], args["bpm_range"][1]
-                )
-            if args["bpm_window"] is not None:
-                creator = creator.with_bpm_bounds(
-                    args["bpm_window"][0] - args["bpm_window"][1],
-                    args["bpm_window"][0] + args["bpm_window"][1],
-                )
-        if args["length_min"] is not None:
-            creator = creator.with_length_lower_bound(args["length_min"][0])
-        if args["length_max"] is not None:
-            creator = creator.with_length_upper_bound(args["length_max"][0])
-
-        if args["random"]:
-            creator = creator.with_random()
-
-        if args["artist_restrict"] is not None:
-            creator = creator.with_artist_restrict(args["artist_restrict"])
-        if args["artist_exclude"] is not None:
-            creator = creator.with_artist_exclude(args["artist_exclude"])
-
-        if args["genre_restrict"] is not None:
-            creator = creator.with_genres_restrict(args["genre_restrict"])
-        if args["genre_exclude"] is not None:
-            creator = creator.with_genres_exclude(args["genre_exclude"])
-
-        if args["time_length"] is not None:
-            creator = creator.with_length(args["time_length"][0])
-
-        if args["root"] is not None:
-            creator = creator.with_root(args["root"][0])
+        creator = playlist.Creator.from_spec(playlist_spec(args))
 
         p = creator.generate_playlist()
 
         if not args["quiet"]:
             print(p)
 
+        if args["explain"]:
+            print(creator.explain())
+
         if args["out"] is not None:
             with open(args["out"][0], "w") as f:
                 f.write(p.to_m3u())
 
 
 if __name__ == "__main__":
+    # Attached databases must be known before building the option choices.
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("-d", "--attach", action="extend", nargs="+")
+    for p in vars(pre_parser.parse_known_args()[0])["attach"] or []:
+        DB.attach(p)
+
+    artists = [e[0] for e in DB.facets("artists")]
+    genres = [e[0] for e in DB.facets("genres")]
+
     parser = argparse.ArgumentParser(prog="analyzer")
     parser.add_argument(
         "-q",
@@ -85,11 +167,20 @@ if __name__ == "__main__":
         help="Disable prints to stdout in playlist creation mode",
         action="store_true",
     )
+    parser.add_argument(
+        "-d",
+        "--attach",
+        help="Attach other library databases to query from",
+        action="extend",
+        nargs="+",
+        metavar="DATABASE",
+        type=pathlib.Path,
+    )
     parser.add_argument(
         "-s",
         "--sync",
-        help="Sync and analyse files in path",
-        nargs=1,
+        help="Sync and analyse files in the paths, each device read at its own pace",
+        nargs="+",
         metavar="PATH",
         type=pathlib.Path,
     )
@@ -99,6 +190,96 @@ if __name__ == "__main__":
         help="Create a playlist",
         action="store_true",
     )
+    parser.add_argument(
+        "--resume",
+        help="Continue an interrupted sync where it stopped",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--backfill",
+        help="Analyse the BPM of tracks synced without a BPM tag",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of parallel analyses",
+        nargs=1,
+        type=int,
+        default=[os.cpu_count() or 1],
+    )
+    parser.add_argument(
+        "--fast-bpm",
+        help="Estimate BPM from a few windows of each track when backfilling",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--refine",
+        help="Fully analyse tracks with an unreliable BPM estimate",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--analyse",
+        help="Analyse the loudness and energy of tracks missing them",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--import-analysis",
+        help="Import the BPMs and features of tracks from another library "
+        "database, or a CSV or NDJSON file keyed by path or content_hash",
+        nargs=1,
+        metavar="FILE",
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        "--write-tags",
+        help="Write analysed BPMs to the file tags",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--save-smart",
+        help="Save the playlist options as a smart playlist, kept up to date "
+        "in the file given with -o",
+        nargs=1,
+        metavar="NAME",
+    )
+    parser.add_argument(
+        "--delete-smart",
+        help="Delete a smart playlist",
+        nargs=1,
+        metavar="NAME",
+    )
+    parser.add_argument(
+        "--refresh-smart",
+        help="Update the smart playlists with the library changes",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="Export a binary snapshot of the library for fast loading, "
+        "then rewritten when the library changes",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-S",
+        "--serve",
+        help="Serve playlists over HTTP, ADDRESS defaults to 127.0.0.1:8765",
+        nargs="?",
+        const="127.0.0.1:8765",
+        metavar="ADDRESS",
+    )
+    parser.add_argument(
+        "--busy-timeout",
+        help="Seconds to wait for another process writing to the database",
+        nargs=1,
+        type=float,
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--explain",
+        help="Print the queries, their plans and the time of each stage",
+        action="store_true",
+    )
     parser.add_argument(
         "-o", "--out", help="Destination file for playlist", type=pathlib.Path, nargs=1
     )
@@ -130,8 +311,7 @@ if __name__ == "__main__":
         nargs="+",
         type=str,
         metavar="ARTIST",
-        choices=DB.column(QueryColumn(name="artist", table="library"))
-        + DB.column(QueryColumn(name="albumartist", table="library")),
+        choices=artists,
     )
     parser.add_argument(
         "-A",
@@ -141,8 +321,7 @@ if __name__ == "__main__":
         nargs="+",
         type=str,
         metavar="ARTIST",
-        choices=DB.column(QueryColumn(name="artist", table="library"))
-        + DB.column(QueryColumn(name="albumartist", table="library")),
+        choices=artists,
     )
     parser.add_argument(
         "-g",
@@ -152,7 +331,7 @@ if __name__ == "__main__":
         nargs="+",
         type=str,
         metavar="GENRE",
-        choices=DB.column(QueryColumn(name="name", table="genres")),
+        choices=genres,
     )
     parser.add_argument(
         "-G",
@@ -162,7 +341,7 @@ if __name__ == "__main__":
         nargs="+",
         type=str,
         metavar="GENRE",
-        choices=DB.column(QueryColumn(name="name", table="genres")),
+        choices=genres,
     )
     parser.add_argument(
         "-l", "--length-min", help="Track length min wanted", nargs=1, type=int
@@ -189,15 +368,61 @@ if __name__ == "__main__":
     parser.add_argument(
         "-O",
         "--option-list",
-        help="List availabe: artists|albumartists|years|bpm",
+        help="List availabe: artists|albumartists|genres|years|bpm",
         nargs=1,
         type=str,
-        choices=["artists", "albumartists", "years", "bpm", "genres"],
+        choices=FACETS,
         metavar="OPTION",
     )
+    parser.add_argument(
+        "--option-prefix",
+        help="Only list the values starting with PREFIX, whatever their case",
+        metavar="PREFIX",
+    )
+    parser.add_argument(
+        "--option-sort",
+        help="Sort the listed values by value or by decreasing track count",
+        choices=["value", "count"],
+        default="value",
+    )
+    parser.add_argument(
+        "--option-counts",
+        help="List the track count and duration of every value",
+        action="store_true",
+    )
     parser.add_argument(
         "-u", "--random", action="store_true", help="Randomize playlist"
     )
+    parser.add_argument(
+        "--seed", help="Seed of the random draws", nargs=1, type=int
+    )
+    parser.add_argument(
+        "--profile",
+        help="Chain segments of BPM range and duration, e.g. 100-120:10 140-150:30",
+        nargs="+",
+        type=profile_segment,
+        metavar="BPM_MIN-BPM_MAX:MINUTES",
+    )
+    parser.add_argument(
+        "--similar-to",
+        help="Pick the K tracks most similar to the track TRACK_ID",
+        nargs=2,
+        type=int,
+        metavar=("TRACK_ID", "K"),
+    )
+    parser.add_argument(
+        "--artist-cap",
+        help="Maximum number of tracks per artist in a random playlist",
+        nargs=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--weight",
+        help="Weight the random draws by a column",
+        nargs=1,
+        type=str,
+        choices=list(playlist.WEIGHT_COLUMNS),
+    )
 
     parser.add_argument(
         "-m",
@@ -0,0 +1,219 @@
+"""Merge of analysis data computed elsewhere: another library database, or
+CSV and NDJSON exports such as those of DJ software.
+
+Rows are keyed by `path` or `content_hash`, the SHA-256 of the file, and
+may give `bpm`, `bpm_confidence`, `loudness`, `replaygain` and `energy`.
+Rows are staged and merged by batches. The content hashes of the library
+are only computed if some rows do not match on their path.
+"""
+import csv
+import hashlib
+import json
+import pathlib
+import sqlite3
+from concurrent.futures import as_completed
+from typing import Iterable, Iterator, Optional
+
+from awesome_progress_bar import ProgressBar
+
+from database import DB
+import devices
+
+COLUMNS = [
+    "path",
+    "content_hash",
+    "bpm",
+    "bpm_confidence",
+    "loudness",
+    "replaygain",
+    "energy",
+]
+# Other names of the columns in exports.
+ALIASES = {
+    "location": "path",
+    "file": "path",
+    "hash": "content_hash",
+    "sha256": "content_hash",
+    "tempo": "bpm",
+}
+
+# Rows staged and merged at a time.
+BATCH_SIZE = 5000
+# Bytes read at a time when hashing a file.
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def normalize(row: dict) -> dict:
+    """Returns the row with every column, renamed and converted."""
+    row = {
+        ALIASES.get(k.strip().lower(), k.strip().lower()): v
+        for k, v in row.items()
+        if k is not None
+    }
+
+    e = {}
+    for name in COLUMNS:
+        value = row.get(name)
+        if value is None or value == "":
+            e[name] = None
+        elif name in ["path", "content_hash"]:
+            e[name] = str(value)
+        else:
+            e[name] = float(value)
+
+    if e["bpm"] is not None:
+        e["bpm"] = round(e["bpm"]) if e["bpm"] > 0 else None
+    return e
+
+
+def read_db(path: str) -> Iterator[dict]:
+    """Rows of the library of another database."""
+    uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        columns = [e[1] for e in conn.execute("PRAGMA table_info(library)")]
+        names = [name for name in COLUMNS if name in columns]
+        if "path" not in names and "content_hash" not in names:
+            raise ValueError(f"{path} has no library to import")
+
+        cursor = conn.execute(f"SELECT {', '.join(names)} FROM library")
+        while rows := cursor.fetchmany(BATCH_SIZE):
+            for row in rows:
+                yield dict(zip(names, row))
+    finally:
+        conn.close()
+
+
+def read_csv(path: str) -> Iterator[dict]:
+    # Exports of Windows software start with a byte order mark.
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.DictReader(f)
+
+
+def read_ndjson(path: str) -> Iterator[dict]:
+    with open(path) as f:
+        for line in f:
+            if line.strip() != "":
+                yield json.loads(line)
+
+
+def read(path: str) -> Iterator[dict]:
+    """Normalized rows of a file, its format recognized from its content."""
+    with open(path, "rb") as f:
+        head = f.read(16)
+
+    if head == b"SQLite format 3\0":
+        rows = read_db(path)
+    elif head.lstrip().startswith(b"{"):
+        rows = read_ndjson(path)
+    else:
+        rows = read_csv(path)
+
+    for n, row in enumerate(rows, 1):
+        try:
+            yield normalize(row)
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(f"{path}: row {n}: {e}")
+
+
+def content_hash(path: str) -> Optional[str]:
+    """SHA-256 of a file, `None` if it cannot be read."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                h.update(chunk)
+    except OSError:
+        return None
+
+    return h.hexdigest()
+
+
+def hash_library(progress_bar: bool = True, batch_size: int = 100) -> None:
+    """Computes the missing content hashes of the library, reading each
+    device at its own pace."""
+    tracks = DB.unhashed_tracks()
+    if len(tracks) == 0:
+        return
+
+    if progress_bar:
+        bar = ProgressBar(len(tracks), "Hashing", use_eta=True)
+
+    scheduler = devices.DeviceScheduler()
+    futures = {}
+    hashes = []
+
+    try:
+        for col_id, p in tracks:
+            try:
+                futures[scheduler.submit(p, content_hash, p)] = (col_id, p)
+            except OSError:
+                if progress_bar:
+                    bar.iter(f" {pathlib.Path(p).name[:25]}")
+
+        for future in as_completed(futures):
+            col_id, p = futures[future]
+            h = future.result()
+            if h is not None:
+                hashes.append((col_id, h))
+
+            if len(hashes) >= batch_size:
+                DB.set_content_hashes(hashes)
+                hashes = []
+
+            if progress_bar:
+                bar.iter(f" {pathlib.Path(p).name[:25]}")
+    except BaseException:
+        if progress_bar:
+            bar.stop()
+        raise
+    finally:
+        scheduler.shutdown()
+        DB.set_content_hashes(hashes)
+
+    if progress_bar:
+        bar.wait()
+
+
+def batches(rows: Iterable[dict]) -> Iterator[list[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+
+def import_analysis(path: str, progress_bar: bool = True) -> tuple[int, int]:
+    """Merges the analysis rows of the file `path` into the library. Returns
+    the numbers of matched and unmatched rows."""
+    matched = 0
+    unmatched = 0
+    # Rows matching no path, retried once the library is hashed.
+    by_hash = []
+
+    for batch in batches(read(path)):
+        keyed = [
+            e for e in batch if e["path"] is not None or e["content_hash"] is not None
+        ]
+        unmatched += len(batch) - len(keyed)
+
+        n, rest = DB.merge_analysis(keyed)
+        matched += n
+        for e in rest:
+            if e["content_hash"] is not None:
+                by_hash.append(e)
+            else:
+                unmatched += 1
+
+    if len(by_hash) > 0:
+        hash_library(progress_bar=progress_bar)
+        for batch in batches(by_hash):
+            n, rest = DB.merge_analysis(batch)
+            matched += n
+            unmatched += len(rest)
+
+    return matched, unmatched
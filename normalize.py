@@ -0,0 +1,38 @@
+import re
+from typing import Optional
+
+# Seconds two versions of a recording may differ by.
+LENGTH_TOLERANCE = 3
+
+feat_brackets_pattern = re.compile(
+    r"[\(\[]\s*(feat|ft|featuring)\b[^\)\]]*[\)\]]", re.IGNORECASE
+)
+feat_pattern = re.compile(r"\s(feat|ft|featuring)\b[^\(\[]*", re.IGNORECASE)
+punctuation_pattern = re.compile(r"[\W_]+")
+
+
+def normalize(s: str) -> str:
+    """Case-folds `s` and strips featured artists and punctuation."""
+    s = feat_brackets_pattern.sub(" ", s)
+    s = feat_pattern.sub(" ", s)
+    return punctuation_pattern.sub(" ", s.casefold()).strip()
+
+
+def duplicate_key(title: str, albumartist: str) -> Optional[str]:
+    """Key shared by the versions of a recording, whatever their format.
+    Tracks of a key are duplicates when their lengths are the same, see
+    `same_length`."""
+    if title is None:
+        return None
+
+    artist = "" if albumartist is None else normalize(albumartist.split(";")[0])
+
+    return f"{normalize(title)}|{artist}"
+
+
+def same_length(a: Optional[int], b: Optional[int]) -> bool:
+    """Whether two lengths, in seconds, can be the ones of two versions of a
+    recording. Encodings of a recording differ by about a second."""
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= LENGTH_TOLERANCE
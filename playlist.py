@@ -1,9 +1,17 @@
 import os
+import copy
+import json
 import random
+import time
+from typing import Union
 from database import DB
+import similarity
 from query import (
     Query,
     QueryNotInOption,
+    QueryArtistOption,
+    QueryNotArtistOption,
+    QueryCanonicalOption,
     ColumnType,
     QueryColumn,
     QueryInOption,
@@ -13,6 +21,23 @@ from query import (
 )
 
 
+# Tracks of a profile segment given to the subset-sum solver, and the
+# seconds a segment may exceed its target by.
+PROFILE_CANDIDATES = 300
+PROFILE_OVERSHOOT = 120
+
+# Numeric library columns random draws can be weighted by.
+WEIGHT_COLUMNS = {
+    name: QueryColumn(name, col_type, "library", name)
+    for name, col_type in [
+        ("bpm", ColumnType.INT),
+        ("length", ColumnType.INT),
+        ("year", ColumnType.INT),
+        ("energy", ColumnType.FLOAT),
+    ]
+}
+
+
 def sec_to_min(sec: int) -> str:
     s = sec % 60
     m = sec // 60
@@ -30,6 +55,21 @@ def sec_to_hour(sec: int) -> str:
 
 
 class Track:
+    # Fields returned by `get` and `to_dict`.
+    fields = [
+        "id",
+        "path",
+        "title",
+        "albumartist",
+        "artist",
+        "composer",
+        "artistsort",
+        "album",
+        "bpm",
+        "length",
+    ]
+    __slots__ = fields + ["genres"]
+
     def __init__(
         self,
         id: str = "",
@@ -55,18 +95,11 @@ class Track:
         self.genres = genres
         self.bpm = bpm
         self.length = length
-        self.dict = {
-            "id": self.get_id,
-            "path": self.get_path,
-            "title": self.get_title,
-            "albumartist": self.get_albumartist,
-            "artist": self.get_artist,
-            "composer": self.get_composer,
-            "artistsort": self.get_artistsort,
-            "album": self.get_album,
-            "bpm": self.get_bpm,
-            "length": self.get_length,
-        }
+
+    @classmethod
+    def from_row(cls, names: list[str], row: tuple):
+        """Row factory of `DB.iter_query`."""
+        return cls(**dict(zip(names, row)))
 
     def __hash__(self):
         return hash((self.title, self.albumartist))
@@ -85,7 +118,14 @@ class Track:
         return f"#EXTINF:{self.length},{self.albumartist} - {self.title}\n" + f"{p}"
 
     def get(self, member: str):
-        return self.dict[member]()
+        if member not in self.fields:
+            raise KeyError(member)
+        return getattr(self, member)
+
+    def to_dict(self) -> dict:
+        d = {k: getattr(self, k) for k in self.fields}
+        d["genres"] = self.genres
+        return d
 
     def get_id(self) -> str:
         return self.id
@@ -138,6 +178,15 @@ class Playlist:
 
         return s
 
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "title": self.title,
+                "length": sum(t.length for t in self.tracks),
+                "tracks": [t.to_dict() for t in self.tracks],
+            }
+        )
+
     def sort(self, keys: list[str] = []) -> None:
         def k(track: Track):
             return tuple([track.get(field) for field in keys])
@@ -145,10 +194,10 @@ class Playlist:
         self.tracks.sort(key=lambda t: k(t))
 
     def remove_duplicates(self):
-        self.tracks = list(set(self.tracks))
+        self.tracks = list(dict.fromkeys(self.tracks))
 
-    def shuffle(self) -> None:
-        random.shuffle(self.tracks)
+    def shuffle(self, rng: random.Random = random) -> None:
+        rng.shuffle(self.tracks)
 
     def __repr__(self) -> str:
         # s = f"{self.title}:\n"
@@ -169,9 +218,12 @@ class Playlist:
         s += f"\n{sec_to_hour(time)} : {i}"
         return s
 
-    def limit_time(self, minutes: int) -> None:
+    def limit_time(
+        self, minutes: int, shuffle: bool = True, rng: random.Random = random
+    ) -> None:
 
-        self.shuffle()
+        if shuffle:
+            self.shuffle(rng)
 
         W = minutes * 60
         t = 0
@@ -193,6 +245,34 @@ class Playlist:
                 break
 
 
+def fill_duration(tracks: list[dict], seconds: int) -> list[dict]:
+    """Returns the subset of `tracks` whose total length is the closest to
+    `seconds`, in their order.
+
+    Subset-sum over a bitset: bit `s` of `reachable[i]` is set when a subset
+    of the first `i` tracks lasts `s` seconds. Sums beyond the overshoot
+    allowed are dropped."""
+    limit = seconds + PROFILE_OVERSHOOT
+    mask = (1 << (limit + 1)) - 1
+    reachable = [1]
+    for t in tracks:
+        reachable.append((reachable[-1] | (reachable[-1] << t["length"])) & mask)
+
+    sums = reachable[-1]
+    best = min(
+        (s for s in range(limit + 1) if sums >> s & 1),
+        key=lambda s: abs(s - seconds),
+    )
+
+    chosen = []
+    for i in range(len(tracks), 0, -1):
+        if not reachable[i - 1] >> best & 1:
+            chosen.append(tracks[i - 1])
+            best -= tracks[i - 1]["length"]
+
+    return chosen[::-1]
+
+
 class Creator:
     def __init__(self):
         self.query = Query(
@@ -217,24 +297,296 @@ class Creator:
         )
 
         self.query.add_table("genres")
+        self.canonical = QueryCanonicalOption()
+        self.query.add_option(self.canonical)
 
         self.length = -1
         self.title = ""
         self.root_path = ""
+        self.random = False
+        self.weight: QueryColumn = None
+        self.artist_cap = -1
+        self.similar: tuple[int, int] = None
+        self.profile: list[tuple[int, int, int]] = []
+        self.rng = random.Random()
+        # Diagnostics of the last generation: queries run and
+        # `(stage, rows, seconds)`.
+        self.executed: list[Query] = []
+        self.stats: list[tuple[str, int, float]] = []
+
+    @classmethod
+    def from_spec(cls, spec: dict):
+        """Builds a creator from a playlist specification, a dict with the
+        same keys as the command line options."""
+        creator = cls()
+
+        if spec.get("bpm_min") is not None or spec.get("bpm_max") is not None:
+            if spec.get("bpm_min") is not None:
+                creator = creator.with_bpm_lower_bound(spec["bpm_min"])
+            if spec.get("bpm_max") is not None:
+                creator = creator.with_bpm_upper_bound(spec["bpm_max"])
+        else:
+            if spec.get("bpm_range") is not None:
+                creator = creator.with_bpm_bounds(
+                    int(spec["bpm_range"][0]), int(spec["bpm_range"][1])
+                )
+            if spec.get("bpm_window") is not None:
+                creator = creator.with_bpm_bounds(
+                    spec["bpm_window"][0] - spec["bpm_window"][1],
+                    spec["bpm_window"][0] + spec["bpm_window"][1],
+                )
+        if spec.get("length_min") is not None:
+            creator = creator.with_length_lower_bound(spec["length_min"])
+        if spec.get("length_max") is not None:
+            creator = creator.with_length_upper_bound(spec["length_max"])
+
+        if spec.get("random"):
+            creator = creator.with_random(spec.get("weight"))
+        if spec.get("seed") is not None:
+            creator = creator.with_seed(spec["seed"])
+        if spec.get("artist_cap") is not None:
+            creator = creator.with_artist_cap(spec["artist_cap"])
+
+        if spec.get("profile"):
+            creator = creator.with_profile([tuple(e) for e in spec["profile"]])
+        if spec.get("similar_to") is not None:
+            creator = creator.with_similar_to(
+                int(spec["similar_to"][0]), int(spec["similar_to"][1])
+            )
+
+        if spec.get("artist_restrict"):
+            creator = creator.with_artist_restrict(spec["artist_restrict"])
+        if spec.get("artist_exclude"):
+            creator = creator.with_artist_exclude(spec["artist_exclude"])
+
+        if spec.get("genre_restrict"):
+            creator = creator.with_genres_restrict(spec["genre_restrict"])
+        if spec.get("genre_exclude"):
+            creator = creator.with_genres_exclude(spec["genre_exclude"])
+
+        if spec.get("time_length") is not None:
+            creator = creator.with_length(spec["time_length"])
+
+        if spec.get("root") is not None:
+            creator = creator.with_root(spec["root"])
+
+        if spec.get("title") is not None:
+            creator.title = spec["title"]
+
+        return creator
 
     def generate_playlist(self) -> Playlist:
         p = Playlist(self.title, self.root_path)
-
-        for args in DB.query(self.query):
-            p.add_track(Track(**args))
-
-        p.remove_duplicates()
+        self.executed = []
+        self.stats = []
+
+        if self.profile:
+            for args in self.__profile():
+                p.add_track(Track(**args))
+        elif self.similar is not None:
+            for args in self.__similar():
+                p.add_track(Track(**args))
+        elif self.random:
+            for args in self.__sample():
+                p.add_track(Track(**args))
+        else:
+            start = time.perf_counter()
+            self.executed.append(self.query)
+            for t in DB.iter_query(self.query, Track.from_row):
+                p.add_track(t)
+            self.__stage("query", len(p.tracks), start)
 
         if self.length > 0:
-            p.limit_time(self.length)
+            start = time.perf_counter()
+            if self.random or self.similar is not None or self.profile:
+                p.limit_time(self.length, shuffle=False)
+            else:
+                p.limit_time(self.length, rng=self.rng)
+            self.__stage("limit_time", len(p.tracks), start)
 
         return p
 
+    def __query(self, query: Query, sources: list[str] = None) -> list[dict]:
+        self.executed.append(query)
+        return DB.query(query, sources)
+
+    def __stage(self, name: str, rows: int, start: float) -> None:
+        self.stats.append((name, rows, time.perf_counter() - start))
+
+    def explain(self) -> str:
+        """Describes the last generation: SQL, arguments and plan of every
+        query, rows and time of every stage, and warnings about full scans
+        and temporary B-trees."""
+        s = ""
+        warnings = []
+
+        for query in self.executed:
+            for schema, sql, args, plan in DB.explain(query):
+                s += f"-- {schema}\n{sql}\n-- args: {args}\n-- plan:\n"
+
+                depth = {0: -1}
+                for node, parent, detail in plan:
+                    depth[node] = depth.get(parent, -1) + 1
+                    s += "   " + "  " * depth[node] + detail + "\n"
+
+                    if detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail:
+                        warnings.append(f"{schema}: full scan ({detail})")
+                    if "TEMP B-TREE" in detail:
+                        warnings.append(f"{schema}: temporary B-tree ({detail})")
+                s += "\n"
+
+        s += "stage          rows      time\n"
+        for name, rows, seconds in self.stats:
+            s += f"{name:<12} {rows:>6} {seconds * 1000:>7.1f}ms\n"
+        s += f"{'total':<12} {'':>6} {sum(e[2] for e in self.stats) * 1000:>7.1f}ms\n"
+
+        for w in warnings:
+            s += f"\nWARNING {w}"
+
+        return s
+
+    def derived_query(self, columns: list[QueryColumn]) -> Query:
+        """Copy of the query with other columns, unordered and unlimited."""
+        query = copy.copy(self.query)
+        query.columns = columns
+        query.options = list(self.query.options)
+        query.order_by_random = False
+        query.limit = -1
+        return query
+
+    def __sample(self) -> list[dict]:
+        """Draws tracks at random among the matching ones.
+
+        Only the light candidate columns are read for every matching track,
+        then the drawn tracks are fetched by path. Draws are uniform, or
+        weighted by `self.weight`, and stop at the wanted number of tracks or
+        length."""
+        candidates = self.derived_query(
+            [
+                QueryColumn("path", ColumnType.STR, "library", "path"),
+                QueryColumn("albumartist", ColumnType.STR, "library", "albumartist"),
+                QueryColumn("length", ColumnType.INT, "library", "length"),
+            ]
+            + ([] if self.weight is None else [self.weight])
+        )
+        start = time.perf_counter()
+        rows = self.__query(candidates)
+        self.__stage("candidates", len(rows), start)
+
+        start = time.perf_counter()
+        if self.weight is None:
+            self.rng.shuffle(rows)
+        else:
+            # Weighted sampling without replacement (Efraimidis-Spirakis).
+            name = self.weight.real_name()
+            rows = [r for r in rows if r[name] is not None and r[name] > 0]
+            rows.sort(key=lambda r: self.rng.random() ** (1 / r[name]), reverse=True)
+
+        limit = self.query.limit
+        seconds = self.length * 60
+        per_artist = {}
+        paths = []
+        total = 0
+
+        for r in rows:
+            if 0 < limit <= len(paths) or 0 < seconds <= total:
+                break
+
+            n = per_artist.get(r["albumartist"], 0)
+            if 0 < self.artist_cap <= n:
+                continue
+            per_artist[r["albumartist"]] = n + 1
+
+            paths.append(r["path"])
+            total += r["length"] or 0
+        self.__stage("draw", len(paths), start)
+
+        start = time.perf_counter()
+        query = self.derived_query(self.query.columns)
+        query.add_option(QueryInOption("library", "path", paths))
+        tracks = {t["path"]: t for t in self.__query(query)}
+        self.__stage("fetch", len(tracks), start)
+
+        return [tracks[p] for p in paths if p in tracks]
+
+    def __similar(self) -> list[dict]:
+        """Returns the tracks nearest to the seed one among the matching
+        ones, nearest first. The index only holds the main library, ids are
+        only read from it."""
+        track_id, k = self.similar
+
+        among = None
+        if any(o is not self.canonical for o in self.query.options):
+            start = time.perf_counter()
+            candidates = self.derived_query(
+                [QueryColumn("id", ColumnType.INT, "library", "id")]
+            )
+            among = {r["id"] for r in self.__query(candidates, ["main"])}
+            self.__stage("candidates", len(among), start)
+
+        start = time.perf_counter()
+        ids = similarity.nearest(track_id, k, among)
+        self.__stage("nearest", len(ids), start)
+
+        start = time.perf_counter()
+        query = self.derived_query(self.query.columns)
+        query.add_option(QueryInOption("library", "id", ids))
+        tracks = {}
+        for t in self.__query(query, ["main"]):
+            tracks.setdefault(t["id"], t)
+        self.__stage("fetch", len(tracks), start)
+
+        return [tracks[i] for i in ids if i in tracks]
+
+    def __profile(self) -> list[dict]:
+        """Fills every segment of the profile in turn with tracks of its BPM
+        range, none of them repeated, lasting as close as possible to the
+        segment duration. Tracks are keyed by path, ids are only unique
+        within one database."""
+        candidates = self.derived_query(
+            [
+                QueryColumn("path", ColumnType.STR, "library", "path"),
+                QueryColumn("bpm", ColumnType.INT, "library", "bpm"),
+                QueryColumn("length", ColumnType.INT, "library", "length"),
+            ]
+        )
+        candidates.add_option(
+            QueryBetweenOption(
+                "library",
+                "bpm",
+                min(e[0] for e in self.profile),
+                max(e[1] for e in self.profile),
+            )
+        )
+        start = time.perf_counter()
+        rows = [r for r in self.__query(candidates) if r["length"]]
+        self.__stage("candidates", len(rows), start)
+
+        paths = []
+        used = set()
+        for i, (bpm_min, bpm_max, minutes) in enumerate(self.profile):
+            start = time.perf_counter()
+            segment = [
+                r
+                for r in rows
+                if bpm_min <= r["bpm"] <= bpm_max and r["path"] not in used
+            ]
+            self.rng.shuffle(segment)
+            chosen = fill_duration(segment[:PROFILE_CANDIDATES], minutes * 60)
+            paths += [r["path"] for r in chosen]
+            used.update(r["path"] for r in chosen)
+            self.__stage(f"segment {i + 1}", len(chosen), start)
+
+        start = time.perf_counter()
+        query = self.derived_query(self.query.columns)
+        query.add_option(QueryInOption("library", "path", paths))
+        tracks = {}
+        for t in self.__query(query):
+            tracks.setdefault(t["path"], t)
+        self.__stage("fetch", len(tracks), start)
+
+        return [tracks[p] for p in paths if p in tracks]
+
     def with_number_of_tracks(self, n: int):
         self.query.limit = n
         return self
@@ -259,12 +611,14 @@ class Creator:
         self.query.add_option(QuerySupToOption("library", "length", bound))
         return self
 
-    def with_artist_restrict(self, artists: list[str]):
-        self.query.add_option(QueryInOption("library", "albumartist", artists))
+    def with_artist_restrict(self, artists: list[Union[int, str]]):
+        """Keeps the tracks crediting any of `artists`, names or ids."""
+        self.query.add_option(QueryArtistOption(artists))
         return self
 
-    def with_artist_exclude(self, artists: list[str]):
-        self.query.add_option(QueryNotInOption("library", "albumartist", artists))
+    def with_artist_exclude(self, artists: list[Union[int, str]]):
+        """Removes the tracks crediting any of `artists`, names or ids."""
+        self.query.add_option(QueryNotArtistOption(artists))
         return self
 
     def with_genres_restrict(self, genres: list[str]):
@@ -275,8 +629,42 @@ class Creator:
         self.query.add_option(QueryNotInOption("genres", "name", genres))
         return self
 
-    def with_random(self):
-        self.query.order_by_random = True
+    def with_duplicates(self):
+        """Keeps every version of a track instead of the preferred one."""
+        if self.canonical in self.query.options:
+            self.query.options.remove(self.canonical)
+        return self
+
+    def with_random(self, weight: str = None):
+        """Draws the tracks at random, weighted by the `weight` column of the
+        library if given, one of `WEIGHT_COLUMNS`."""
+        self.random = True
+        if weight is not None:
+            if weight not in WEIGHT_COLUMNS:
+                raise ValueError(f"Cannot weight by {weight}")
+            self.weight = WEIGHT_COLUMNS[weight]
+        return self
+
+    def with_seed(self, seed: int):
+        self.rng = random.Random(seed)
+        return self
+
+    def with_similar_to(self, track_id: int, k: int):
+        """Picks the `k` tracks of the main library most similar to the
+        track `track_id`, by tempo, year, length and genres. Other filters
+        restrict the candidates."""
+        self.similar = (track_id, k)
+        return self
+
+    def with_profile(self, segments: list[tuple[int, int, int]]):
+        """Builds the playlist as consecutive segments of
+        `(bpm_min, bpm_max, minutes)`."""
+        self.profile = list(segments)
+        return self
+
+    def with_artist_cap(self, n: int):
+        """Draws at most `n` tracks per album artist."""
+        self.artist_cap = n
         return self
 
     def with_length(self, length: int):
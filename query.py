@@ -1,3 +1,4 @@
+import json
 from enum import Enum
 from typing import Union, Tuple
 
@@ -54,8 +55,12 @@ class QueryJoin:
         self.to_col = to_col
 
     def __repr__(self) -> str:
+        return self.to_query()
+
+    def to_query(self, schema: str = None) -> str:
+        table = self.to_table if schema is None else f"{schema}.{self.to_table}"
         return f"""
-JOIN {self.to_table}
+JOIN {table}
 ON {self.from_table}.{self.from_col} = {self.to_table}.{self.to_col}"""
 
 
@@ -69,7 +74,7 @@ class QueryOption:
         self.table = table
         self.column = column
 
-    def to_query(self) -> QueryOptionArg:
+    def to_query(self, schema: str = None) -> QueryOptionArg:
         return "", []
 
 
@@ -78,7 +83,7 @@ class QueryLikeOption(QueryOption):
         super().__init__(table, column)
         self.like = like
 
-    def to_query(self) -> QueryOptionArg:
+    def to_query(self, schema: str = None) -> QueryOptionArg:
         return f'{self.table}.{self.column} LIKE "%{self.like}%"', []
 
 
@@ -87,7 +92,7 @@ class QueryEqualOption(QueryOption):
         super().__init__(table, column)
         self.equal = equal
 
-    def to_query(self) -> QueryOptionArg:
+    def to_query(self, schema: str = None) -> QueryOptionArg:
         return f"{self.table}.{self.column} = ?", [self.equal]
 
 
@@ -96,7 +101,7 @@ class QueryInfToOption(QueryOption):
         super().__init__(table, column)
         self.inf = inf
 
-    def to_query(self) -> QueryOptionArg:
+    def to_query(self, schema: str = None) -> QueryOptionArg:
         return f"{self.table}.{self.column} < ?", [self.inf]
 
 
@@ -105,7 +110,7 @@ class QuerySupToOption(QueryOption):
         super().__init__(table, column)
         self.sup = sup
 
-    def to_query(self) -> Tuple[str, Union[str, int, None]]:
+    def to_query(self, schema: str = None) -> Tuple[str, Union[str, int, None]]:
         return f"{self.table}.{self.column} > ?", [self.sup]
 
 
@@ -114,7 +119,7 @@ class QueryNotEqualOption(QueryOption):
         super().__init__(table, column)
         self.not_equal = not_equal
 
-    def to_query(self) -> Tuple[str, Union[str, int, None]]:
+    def to_query(self, schema: str = None) -> Tuple[str, Union[str, int, None]]:
         return f"{self.table}.{self.column} > ?", [self.not_equal]
 
 
@@ -124,11 +129,27 @@ class QueryBetweenOption(QueryOption):
         self.inf = inf
         self.sup = sup
 
-    def to_query(self) -> Tuple[str, Union[str, int, None]]:
+    def to_query(self, schema: str = None) -> Tuple[str, Union[str, int, None]]:
         return f"{self.table}.{self.column} BETWEEN ? AND ?", [self.inf, self.sup]
 
 
+class QueryCanonicalOption(QueryOption):
+    """Keeps a single track of each duplicate group."""
+
+    def __init__(self, table: str = "library"):
+        super().__init__(table, "canonical_id")
+
+    def to_query(self, schema: str = None) -> QueryOptionArg:
+        t = self.table
+        return f"({t}.canonical_id IS NULL OR {t}.canonical_id = {t}.id)", []
+
+
 class QueryInOption(QueryOption):
+    """Membership filter. The values are bound as one JSON array, so the
+    statement does not depend on their number nor their content."""
+
+    operator = "IN"
+
     def __init__(
         self,
         table: str,
@@ -140,45 +161,50 @@ class QueryInOption(QueryOption):
         self.args = args
         self.col_type = col_type
 
-    def to_query(self) -> Tuple[str, Union[str, int, None]]:
-        s = f"{self.table}.{self.column} IN ("
+    def to_query(self, schema: str = None) -> Tuple[str, Union[str, int, None]]:
+        s = f"{self.table}.{self.column} {self.operator} "
+        s += "(SELECT value FROM json_each(?))"
 
-        for e in self.args:
-            s += "?,"
+        return s, [json.dumps(list(self.args))]
 
-        s = s[:-1]
-        s += ")"
 
-        return s, self.args
+class QueryNotInOption(QueryInOption):
+    operator = "NOT IN"
 
 
-class QueryNotInOption(QueryOption):
-    def __init__(
-        self,
-        table: str,
-        column: str,
-        args: Union[int, str] = [],
-        col_type: ColumnType = ColumnType.INT,
-    ):
-        super().__init__(table, column)
-        self.args = args
-        self.col_type = col_type
+class QueryArtistOption(QueryInOption):
+    """Tracks crediting any of `artists` as artist or album artist. Artists
+    are given by name, or by id in the main database. Names are only looked
+    up in the artists table, tracks are then matched on integer keys. Ids are
+    local to each database, attached ones are matched on the names of the ids
+    in the main database."""
 
-    def to_query(self) -> Tuple[str, Union[str, int, None]]:
-        s = f"{self.table}.{self.column} NOT IN ("
+    def __init__(self, artists: list[Union[int, str]]):
+        super().__init__("library", "id", artists)
 
-        if self.col_type == ColumnType.INT:
-            for e in self.args:
-                s += f"{e},"
-            s = s[:-1]
+    def to_query(self, schema: str = None) -> QueryOptionArg:
+        prefix = "" if schema is None else f"{schema}."
 
+        if all(isinstance(e, int) for e in self.args):
+            if schema is None:
+                match = "track_artists.artist_id IN (SELECT value FROM json_each(?))"
+            else:
+                match = """artists.name IN (
+        SELECT name FROM main.artists
+        WHERE id IN (SELECT value FROM json_each(?)))"""
         else:
-            for e in self.args:
-                s += f"'{e}',"
-            s = s[:-1]
-            s += ")"
+            match = "artists.name IN (SELECT value FROM json_each(?))"
+
+        s = f"""{self.table}.{self.column} {self.operator} (
+    SELECT track_artists.library_id FROM {prefix}track_artists
+    JOIN {prefix}artists ON artists.id = track_artists.artist_id
+    WHERE {match})"""
+
+        return s, [json.dumps(list(self.args))]
+
 
-        return s, []
+class QueryNotArtistOption(QueryArtistOption):
+    operator = "NOT IN"
 
 
 class Query:
@@ -230,7 +256,9 @@ class Query:
     def add_with(self, with_query, as_name: str) -> None:
         self.cte.append((with_query, as_name))
 
-    def to_query(self) -> QueryOptionArg:
+    def to_query(self, schema: str = None) -> QueryOptionArg:
+        """Builds the SQL query. If `schema` is given, tables are read from
+        this attached database instead of `main`."""
         args = []
         s = ""
         columns = []
@@ -252,19 +280,20 @@ class Query:
         else:
             select = "*"
 
-        s += f"SELECT DISTINCT {select} FROM {self.tables[0]}"
+        table = self.tables[0] if schema is None else f"{schema}.{self.tables[0]}"
+        s += f"SELECT DISTINCT {select} FROM {table}"
 
         if len(self.joins) > 0:
             join = ""
             for e in self.joins:
-                join += str(e)
+                join += e.to_query(schema)
 
             s += join
 
         if len(self.options) > 0:
             option = "\nWHERE "
             for e in self.options:
-                o, a = e.to_query()
+                o, a = e.to_query(schema)
                 option += o + "\nAND "
                 args += a
 
@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from database import DB
+import playlist
+
+
+class PlaylistServer(ThreadingHTTPServer):
+    """HTTP server answering playlist requests from a warm library.
+
+    Handler threads query through a pool of read-only connections. The
+    option lists are cached until the database data version changes."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int]):
+        super().__init__(address, PlaylistHandler)
+        self.__lock = threading.Lock()
+        self.__version = None
+        self.__options: dict[str, list] = {}
+
+    def options(
+        self, name: str, prefix: str = None, sort: str = "value", limit: int = -1
+    ) -> list:
+        """Values of the facet `name`. Filtered or sorted by count lists are
+        read from the facet table on every request, only the full lists are
+        cached."""
+        if prefix is not None or sort != "value" or limit > 0:
+            return [e[0] for e in DB.facets(name, prefix, sort, limit)]
+
+        with self.__lock:
+            version = DB.data_version()
+            if version != self.__version:
+                self.__version = version
+                self.__options = {}
+
+            if name not in self.__options:
+                self.__options[name] = [e[0] for e in DB.facets(name)]
+
+            return self.__options[name]
+
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+    """`GET /options/<name>` lists the values of an option, filtered by the
+    `prefix`, `sort` (`value` or `count`) and `limit` query parameters.
+    `POST /playlist` takes a JSON playlist specification, with the same keys
+    as the command line options, and answers M3U, or JSON when the `format`
+    key of the specification is `json`."""
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if len(parts) != 2 or parts[0] != "options":
+            self.send_error(404)
+            return
+
+        params = parse_qs(url.query)
+        try:
+            sort = params.get("sort", ["value"])[0]
+            limit = int(params.get("limit", [-1])[0])
+            if sort not in ["value", "count"]:
+                raise ValueError(f"Unknown sort {sort}")
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        try:
+            options = self.server.options(
+                parts[1], params.get("prefix", [None])[0], sort, limit
+            )
+        except KeyError:
+            self.send_error(404, f"Unknown option {parts[1]}")
+            return
+
+        self.__reply(json.dumps(options), "application/json")
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/playlist":
+            self.send_error(404)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            spec = json.loads(self.rfile.read(length) or "{}")
+            if not isinstance(spec, dict):
+                raise ValueError("The specification must be a JSON object")
+            p = playlist.Creator.from_spec(spec).generate_playlist()
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            self.send_error(400, str(e))
+            return
+        except sqlite3.Error as e:
+            self.send_error(500, str(e))
+            return
+
+        if spec.get("format") == "json":
+            self.__reply(p.to_json(), "application/json")
+        else:
+            self.__reply(p.to_m3u(), "audio/x-mpegurl")
+
+    def __reply(self, body: str, content_type: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765) -> None:
+    with PlaylistServer((host, port)) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
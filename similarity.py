@@ -0,0 +1,215 @@
+"""Nearest tracks of a seed track in a feature space of tempo, year, length
+and genres.
+
+Tempos are compared on a log scale modulo an octave, so half and double
+time tracks are close. Genres are compared with the Jaccard distance of the
+genre sets. The index lives in memory and follows the library version: only
+the tracks changed since the last refresh are read again. Distances are
+computed with numpy when installed, in pure Python otherwise.
+"""
+import heapq
+import math
+import threading
+from typing import Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from database import DB
+
+# Differences counting as one unit of distance.
+TEMPO_SCALE = 0.1  # octave
+YEAR_SCALE = 10
+LENGTH_SCALE = 120
+GENRE_SCALE = 0.5
+# Distance of a feature unknown for one of the tracks.
+MISSING_DISTANCE = 1.0
+
+
+class Index:
+    """Features of every track of the main library, by position."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.__clear()
+
+    def __clear(self) -> None:
+        self.version: Optional[int] = None
+        self.positions: dict[int, int] = {}
+        self.ids: list[int] = []
+        self.tempos: list[float] = []
+        self.years: list[float] = []
+        self.lengths: list[float] = []
+        self.canonical: list[bool] = []
+        self.genres: list[frozenset[int]] = []
+        self.arrays: dict = {}
+
+    def refresh(self) -> None:
+        """Reads the tracks changed since the last refresh. The index is
+        rebuilt when tracks were deleted."""
+        if self.version is not None and DB.library_version() == self.version:
+            return
+
+        since = -1 if self.version is None else self.version
+        version, ids, tracks, memberships = DB.similarity_data(since)
+
+        # Deletions are found by id, tracks may have been added meanwhile.
+        if since >= 0 and not ids.issuperset(self.positions):
+            self.__clear()
+            version, ids, tracks, memberships = DB.similarity_data()
+
+        genres: dict[int, set[int]] = {t[0]: set() for t in tracks}
+        for library_id, genre_id in memberships:
+            if library_id in genres:
+                genres[library_id].add(genre_id)
+
+        for library_id, bpm, year, length, canonical in tracks:
+            i = self.positions.get(library_id)
+            if i is None:
+                i = len(self.ids)
+                self.positions[library_id] = i
+                for column in (self.ids, self.tempos, self.years, self.lengths):
+                    column.append(None)
+                self.canonical.append(False)
+                self.genres.append(frozenset())
+
+            self.ids[i] = library_id
+            self.tempos[i] = math.log2(bpm) if bpm else math.nan
+            self.years[i] = math.nan if year is None else float(year)
+            self.lengths[i] = math.nan if length is None else float(length)
+            self.canonical[i] = bool(canonical)
+            self.genres[i] = frozenset(genres[library_id])
+
+        if numpy is not None:
+            self.__build_arrays()
+        self.version = version
+
+    def __build_arrays(self) -> None:
+        members: dict[int, list[int]] = {}
+        for i, g in enumerate(self.genres):
+            for genre_id in g:
+                members.setdefault(genre_id, []).append(i)
+
+        n = len(self.ids)
+        masks = {}
+        for genre_id, rows in members.items():
+            mask = numpy.zeros(n, dtype=numpy.int32)
+            mask[rows] = 1
+            masks[genre_id] = mask
+
+        self.arrays = {
+            "ids": numpy.array(self.ids, dtype=numpy.int64),
+            "tempos": numpy.array(self.tempos, dtype=float),
+            "years": numpy.array(self.years, dtype=float),
+            "lengths": numpy.array(self.lengths, dtype=float),
+            "canonical": numpy.array(self.canonical, dtype=bool),
+            "genre_counts": numpy.array([len(g) for g in self.genres], dtype=int),
+            "genre_masks": masks,
+        }
+
+    def nearest(
+        self, track_id: int, k: int, among: Optional[set[int]] = None
+    ) -> list[int]:
+        """Returns the ids of the `k` tracks nearest to `track_id`, nearest
+        first. Duplicates of other tracks and the seed are left out, and only
+        the tracks in `among` are considered if given."""
+        with self.lock:
+            self.refresh()
+
+            seed = self.positions.get(track_id)
+            if seed is None:
+                raise KeyError(f"Unknown track {track_id}")
+
+            if numpy is not None:
+                return self.__nearest_numpy(seed, k, among)
+            return self.__nearest_python(seed, k, among)
+
+    def __nearest_numpy(
+        self, seed: int, k: int, among: Optional[set[int]]
+    ) -> list[int]:
+        a = self.arrays
+
+        def term(values, scale: float, circular: bool = False):
+            d = values - values[seed]
+            if circular:
+                d = d - numpy.round(d)
+            d = numpy.square(d / scale)
+            d[numpy.isnan(d)] = MISSING_DISTANCE**2
+            return d
+
+        distance = (
+            term(a["tempos"], TEMPO_SCALE, circular=True)
+            + term(a["years"], YEAR_SCALE)
+            + term(a["lengths"], LENGTH_SCALE)
+        )
+
+        seed_genres = self.genres[seed]
+        shared = numpy.zeros(len(self.ids), dtype=numpy.int32)
+        for genre_id in seed_genres:
+            shared += a["genre_masks"][genre_id]
+        union = a["genre_counts"] + len(seed_genres) - shared
+        jaccard = 1 - shared / numpy.maximum(union, 1)
+        jaccard[union == 0] = 0
+        distance += numpy.square(jaccard / GENRE_SCALE)
+
+        excluded = ~a["canonical"]
+        excluded[seed] = True
+        if among is not None:
+            excluded |= ~numpy.isin(a["ids"], list(among))
+        distance[excluded] = numpy.inf
+
+        k = min(k, int(numpy.count_nonzero(~excluded)))
+        if k <= 0:
+            return []
+        rows = numpy.argpartition(distance, k - 1)[:k]
+        rows = rows[numpy.argsort(distance[rows])]
+
+        return [self.ids[i] for i in rows]
+
+    def __nearest_python(
+        self, seed: int, k: int, among: Optional[set[int]]
+    ) -> list[int]:
+        def term(a: float, b: float, scale: float, circular: bool = False) -> float:
+            if math.isnan(a) or math.isnan(b):
+                return MISSING_DISTANCE**2
+            d = a - b
+            if circular:
+                d -= round(d)
+            return (d / scale) ** 2
+
+        tempo = self.tempos[seed]
+        year = self.years[seed]
+        length = self.lengths[seed]
+        seed_genres = self.genres[seed]
+
+        def distance(i: int) -> float:
+            g = self.genres[i]
+            union = len(g | seed_genres)
+            jaccard = 1 - len(g & seed_genres) / union if union > 0 else 0
+
+            return (
+                term(self.tempos[i], tempo, TEMPO_SCALE, circular=True)
+                + term(self.years[i], year, YEAR_SCALE)
+                + term(self.lengths[i], length, LENGTH_SCALE)
+                + (jaccard / GENRE_SCALE) ** 2
+            )
+
+        rows = (
+            i
+            for i in range(len(self.ids))
+            if i != seed
+            and self.canonical[i]
+            and (among is None or self.ids[i] in among)
+        )
+
+        return [self.ids[i] for i in heapq.nsmallest(k, rows, key=distance)]
+
+
+INDEX = Index()
+
+
+def nearest(track_id: int, k: int, among: Optional[set[int]] = None) -> list[int]:
+    """`Index.nearest` on the shared index."""
+    return INDEX.nearest(track_id, k, among)
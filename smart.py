@@ -0,0 +1,103 @@
+"""Smart playlists: playlist specifications saved in the database with their
+current tracks.
+
+A refresh only evaluates the tracks changed since the previous one, so its
+cost follows the size of the change and not the size of the library. Tracks
+deleted from the library leave the playlists with them. Specifications must
+select tracks one by one, drawing tracks at random or up to a length is
+refused.
+"""
+import json
+import os
+import pathlib
+
+from database import DB
+from query import ColumnType, QueryColumn, QueryInOption, QuerySupToOption
+import playlist
+
+# Specification keys whose result depends on more than each track alone.
+UNSUPPORTED_OPTIONS = [
+    "random",
+    "seed",
+    "weight",
+    "artist_cap",
+    "similar_to",
+    "profile",
+    "time_length",
+]
+
+
+def check_spec(spec: dict) -> None:
+    for name in UNSUPPORTED_OPTIONS:
+        if spec.get(name):
+            raise ValueError(f"Smart playlists do not support {name}")
+
+
+def save(name: str, spec: dict, out: str) -> None:
+    """Saves a smart playlist written to the M3U file `out`. It is filled on
+    the next refresh."""
+    check_spec(spec)
+    DB.save_smart_playlist(name, json.dumps(spec), str(pathlib.Path(out).absolute()))
+
+
+def delete(name: str) -> None:
+    DB.delete_smart_playlist(name)
+
+
+def refresh() -> dict[str, tuple[int, int]]:
+    """Brings every smart playlist up to date with the library and rewrites
+    the M3U files of the changed ones. Returns the numbers of added and
+    removed tracks by playlist."""
+    version = DB.library_version()
+    changed: dict[int, set[int]] = {}
+    changes = {}
+
+    for playlist_id, name, spec, out, since, size in DB.smart_playlists():
+        if since == version and os.path.exists(out):
+            continue
+
+        spec = json.loads(spec)
+        if since not in changed:
+            changed[since] = DB.changed_ids(since)
+
+        creator = playlist.Creator.from_spec(spec)
+        query = creator.derived_query(
+            [QueryColumn("id", ColumnType.INT, "library", "id")]
+        )
+        query.add_option(QuerySupToOption("library", "changed", since))
+        matched = {e["id"] for e in DB.query(query, sources=["main"])}
+
+        tracks = DB.smart_playlist_tracks(playlist_id)
+        added = matched.difference(tracks)
+        removed = changed[since].difference(matched).intersection(tracks)
+        DB.update_smart_playlist(playlist_id, added, removed, version)
+
+        # A saved playlist is written on its first refresh even if empty, the
+        # file may hold the tracks of a previous specification.
+        if (
+            since == -1
+            or added
+            or removed
+            or len(tracks) != size
+            or not os.path.exists(out)
+        ):
+            write(creator, DB.smart_playlist_tracks(playlist_id), name, out)
+        changes[name] = (len(added), len(removed))
+
+    return changes
+
+
+def write(creator: playlist.Creator, tracks: list[int], name: str, out: str) -> None:
+    """Writes the tracks of a smart playlist, in library order. The file is
+    replaced atomically."""
+    query = creator.derived_query(creator.query.columns)
+    query.add_option(QueryInOption("library", "id", tracks))
+
+    p = playlist.Playlist(name, creator.root_path)
+    for args in sorted(DB.query(query, sources=["main"]), key=lambda e: e["id"]):
+        p.add_track(playlist.Track(**args))
+
+    tmp = out + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(p.to_m3u())
+    os.replace(tmp, out)
@@ -0,0 +1,156 @@
+"""Columnar binary snapshot of the library, laid out for short-lived tools
+to `mmap` it and filter without parsing. Once exported, the snapshot is
+rewritten after the commands changing the library.
+
+Layout, little endian, every section aligned on 8 bytes:
+
+- header: magic, library version, track, string and genre counts, the byte
+  size of a track genre bitmap and the offsets of the sections
+- `id`: int64 per track
+- `bpm`, `length`, `year`: int32 per track, `NULL_INT` when unknown
+- `path`, `title`, `albumartist`, `artist`, `album`: uint32 per track, index
+  in the string table
+- `genres`: uint32 per genre, index in the string table
+- `genre_bitmap`: one bitmap of the genres per track
+- string table: uint32 offsets, then the UTF-8 strings
+"""
+import os
+import pathlib
+import struct
+from typing import Optional
+
+MAGIC = b"BPMSNAP1"
+NULL_INT = -(2**31)
+
+INT_COLUMNS = ["bpm", "length", "year"]
+STR_COLUMNS = ["path", "title", "albumartist", "artist", "album"]
+SECTIONS = (
+    ["id"]
+    + INT_COLUMNS
+    + STR_COLUMNS
+    + ["genres", "genre_bitmap", "string_offsets", "strings"]
+)
+
+HEADER = struct.Struct(f"<8sQIIII{len(SECTIONS)}Q")
+
+
+def default_path() -> pathlib.Path:
+    from database import db_dir
+
+    return db_dir.joinpath("library.snapshot")
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class _Strings:
+    """Interns strings, `None` included, and numbers them."""
+
+    def __init__(self):
+        self.index: dict[Optional[str], int] = {}
+        self.strings: list[Optional[str]] = []
+
+    def add(self, s: Optional[str]) -> int:
+        i = self.index.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.index[s] = i
+            self.strings.append(s)
+        return i
+
+
+def export(path: str = None) -> pathlib.Path:
+    """Writes a snapshot of the library. The file is replaced atomically."""
+    from database import DB
+
+    path = pathlib.Path(path) if path is not None else default_path()
+    version, tracks, memberships = DB.snapshot_data()
+
+    strings = _Strings()
+    # Index 0 is reserved for NULL strings.
+    strings.add(None)
+
+    genre_names = sorted({name for _, name in memberships})
+    genre_index = {name: i for i, name in enumerate(genre_names)}
+    stride = (len(genre_names) + 7) // 8
+    row_index = {t[0]: i for i, t in enumerate(tracks)}
+
+    bitmap = bytearray(stride * len(tracks))
+    for library_id, name in memberships:
+        i = row_index.get(library_id)
+        if i is not None:
+            g = genre_index[name]
+            bitmap[i * stride + g // 8] |= 1 << (g % 8)
+
+    data = {
+        "id": struct.pack(f"<{len(tracks)}q", *(t[0] for t in tracks)),
+    }
+    for c, col in zip(range(6, 9), INT_COLUMNS):
+        data[col] = struct.pack(
+            f"<{len(tracks)}i",
+            *(NULL_INT if t[c] is None else int(t[c]) for t in tracks),
+        )
+    for c, col in zip(range(1, 6), STR_COLUMNS):
+        data[col] = struct.pack(
+            f"<{len(tracks)}I", *(strings.add(t[c]) for t in tracks)
+        )
+    data["genres"] = struct.pack(
+        f"<{len(genre_names)}I", *(strings.add(g) for g in genre_names)
+    )
+    data["genre_bitmap"] = bytes(bitmap)
+
+    encoded = [b"" if s is None else s.encode("utf-8") for s in strings.strings]
+    offsets = [0]
+    for e in encoded:
+        offsets.append(offsets[-1] + len(e))
+    data["string_offsets"] = struct.pack(f"<{len(offsets)}I", *offsets)
+    data["strings"] = b"".join(encoded)
+
+    section_offsets = []
+    offset = _align(HEADER.size)
+    for name in SECTIONS:
+        section_offsets.append(offset)
+        offset = _align(offset + len(data[name]))
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                version,
+                len(tracks),
+                len(strings.strings),
+                len(genre_names),
+                stride,
+                *section_offsets,
+            )
+        )
+        for name, start in zip(SECTIONS, section_offsets):
+            f.seek(start)
+            f.write(data[name])
+        f.truncate(offset)
+    os.replace(tmp, path)
+
+    return path
+
+
+def refresh(path: str = None) -> bool:
+    """Rewrites the snapshot if one was exported and the library changed
+    since. Returns whether it was rewritten."""
+    from database import DB
+
+    path = pathlib.Path(path) if path is not None else default_path()
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return False
+
+    if len(header) == HEADER.size:
+        magic, version, *_ = HEADER.unpack(header)
+        if magic == MAGIC and version == DB.library_version():
+            return False
+
+    export(path)
+    return True
@@ -1,4 +0,0 @@
-CREATE TABLE IF NOT EXISTS albumartists (
-    id INTEGER PRIMARY KEY,
-    name VARCHAR 
-);
\ No newline at end of file
@@ -0,0 +1,10 @@
+CREATE TEMP TABLE IF NOT EXISTS analysis_import (
+    path VARCHAR,
+    content_hash VARCHAR,
+    bpm INTEGER,
+    bpm_confidence REAL,
+    loudness REAL,
+    replaygain REAL,
+    energy REAL,
+    library_id INTEGER
+);
\ No newline at end of file
@@ -0,0 +1,4 @@
+CREATE TABLE IF NOT EXISTS artists (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR UNIQUE COLLATE NOCASE
+);
\ No newline at end of file
@@ -0,0 +1,4 @@
+CREATE TABLE IF NOT EXISTS backfill_queue (
+    library_id INTEGER PRIMARY KEY,
+    FOREIGN KEY (library_id) REFERENCES library(id) ON DELETE CASCADE
+);
\ No newline at end of file
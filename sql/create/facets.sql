@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS facets (
+    facet VARCHAR,
+    value,
+    tracks INTEGER,
+    duration INTEGER,
+    PRIMARY KEY (facet, value)
+);
\ No newline at end of file
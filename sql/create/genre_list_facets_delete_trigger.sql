@@ -0,0 +1,34 @@
+CREATE TRIGGER IF NOT EXISTS genre_list_facets_delete
+AFTER DELETE ON genre_list
+BEGIN
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(
+            (
+                SELECT
+                    length
+                FROM
+                    library
+                WHERE
+                    id = OLD.library_id
+            ),
+            0
+        )
+    WHERE
+        facet = 'genres'
+        AND value = (
+            SELECT
+                name
+            FROM
+                genres
+            WHERE
+                id = OLD.genre_id
+        );
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'genres'
+        AND tracks <= 0;
+END
\ No newline at end of file
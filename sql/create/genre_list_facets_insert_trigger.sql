@@ -0,0 +1,20 @@
+CREATE TRIGGER IF NOT EXISTS genre_list_facets_insert
+AFTER INSERT ON genre_list
+BEGIN
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'genres',
+        genres.name,
+        1,
+        COALESCE(library.length, 0)
+    FROM
+        genres
+        JOIN library ON library.id = NEW.library_id
+    WHERE
+        genres.id = NEW.genre_id ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+END
\ No newline at end of file
@@ -8,6 +8,7 @@ CREATE TABLE IF NOT EXISTS import (
     artistsort VARCHAR,
     album VARCHAR,
     bpm INTEGER,
+    bpm_confidence REAL,
     length INTEGER,
     year INTEGER
 );
\ No newline at end of file
@@ -8,6 +8,9 @@ CREATE TABLE IF NOT EXISTS library (
     artistsort VARCHAR,
     album VARCHAR,
     bpm INTEGER,
+    bpm_confidence REAL,
     length INTEGER,
-    year INTEGER
+    year INTEGER,
+    dup_key VARCHAR,
+    canonical_id INTEGER
 );
\ No newline at end of file
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS library_changed ON library(changed);
\ No newline at end of file
@@ -0,0 +1,10 @@
+CREATE TRIGGER IF NOT EXISTS library_changed_insert
+AFTER INSERT ON library
+BEGIN
+    UPDATE
+        library
+    SET
+        changed = (SELECT version + 1 FROM library_version)
+    WHERE
+        id = NEW.id;
+END
\ No newline at end of file
@@ -0,0 +1,11 @@
+CREATE TRIGGER IF NOT EXISTS library_changed_update
+AFTER UPDATE ON library
+WHEN NEW.changed IS OLD.changed
+BEGIN
+    UPDATE
+        library
+    SET
+        changed = (SELECT version + 1 FROM library_version)
+    WHERE
+        id = NEW.id;
+END
\ No newline at end of file
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS library_content_hash ON library(content_hash);
\ No newline at end of file
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS library_dup_key ON library(dup_key);
\ No newline at end of file
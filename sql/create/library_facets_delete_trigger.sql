@@ -0,0 +1,55 @@
+CREATE TRIGGER IF NOT EXISTS library_facets_delete
+BEFORE DELETE ON library
+BEGIN
+    -- Unlinked first, while the track length is still readable.
+    DELETE FROM
+        genre_list
+    WHERE
+        library_id = OLD.id;
+    DELETE FROM
+        track_artists
+    WHERE
+        library_id = OLD.id;
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'albumartists'
+        AND value = OLD.albumartist;
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'albumartists'
+        AND value = OLD.albumartist
+        AND tracks <= 0;
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'years'
+        AND value = OLD.year;
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'years'
+        AND value = OLD.year
+        AND tracks <= 0;
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'bpm'
+        AND value = CAST(OLD.bpm / 10 AS INTEGER) * 10;
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'bpm'
+        AND value = CAST(OLD.bpm / 10 AS INTEGER) * 10
+        AND tracks <= 0;
+END
\ No newline at end of file
@@ -0,0 +1,43 @@
+CREATE TRIGGER IF NOT EXISTS library_facets_insert
+AFTER INSERT ON library
+BEGIN
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'albumartists',
+        NEW.albumartist,
+        1,
+        COALESCE(NEW.length, 0)
+    WHERE
+        NEW.albumartist IS NOT NULL ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'years',
+        NEW.year,
+        1,
+        COALESCE(NEW.length, 0)
+    WHERE
+        NEW.year IS NOT NULL ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'bpm',
+        CAST(NEW.bpm / 10 AS INTEGER) * 10,
+        1,
+        COALESCE(NEW.length, 0)
+    WHERE
+        NEW.bpm IS NOT NULL ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+END
\ No newline at end of file
@@ -0,0 +1,115 @@
+CREATE TRIGGER IF NOT EXISTS library_facets_update
+AFTER UPDATE OF albumartist, year, bpm, length ON library
+BEGIN
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'albumartists'
+        AND value = OLD.albumartist;
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'albumartists'
+        AND value = OLD.albumartist
+        AND tracks <= 0;
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'years'
+        AND value = OLD.year;
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'years'
+        AND value = OLD.year
+        AND tracks <= 0;
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'bpm'
+        AND value = CAST(OLD.bpm / 10 AS INTEGER) * 10;
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'bpm'
+        AND value = CAST(OLD.bpm / 10 AS INTEGER) * 10
+        AND tracks <= 0;
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'albumartists',
+        NEW.albumartist,
+        1,
+        COALESCE(NEW.length, 0)
+    WHERE
+        NEW.albumartist IS NOT NULL ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'years',
+        NEW.year,
+        1,
+        COALESCE(NEW.length, 0)
+    WHERE
+        NEW.year IS NOT NULL ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'bpm',
+        CAST(NEW.bpm / 10 AS INTEGER) * 10,
+        1,
+        COALESCE(NEW.length, 0)
+    WHERE
+        NEW.bpm IS NOT NULL ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+    UPDATE
+        facets
+    SET
+        duration = duration + COALESCE(NEW.length, 0) - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'genres'
+        AND value IN (
+            SELECT
+                genres.name
+            FROM
+                genre_list
+                JOIN genres ON genres.id = genre_list.genre_id
+            WHERE
+                genre_list.library_id = NEW.id
+        );
+    UPDATE
+        facets
+    SET
+        duration = duration + COALESCE(NEW.length, 0) - COALESCE(OLD.length, 0)
+    WHERE
+        facet = 'artists'
+        AND value IN (
+            SELECT
+                artists.name
+            FROM
+                track_artists
+                JOIN artists ON artists.id = track_artists.artist_id
+            WHERE
+                track_artists.library_id = NEW.id
+        );
+END
\ No newline at end of file
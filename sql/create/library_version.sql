@@ -0,0 +1,4 @@
+CREATE TABLE IF NOT EXISTS library_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
\ No newline at end of file
@@ -0,0 +1,3 @@
+CREATE TABLE IF NOT EXISTS scan_journal (
+    directory VARCHAR PRIMARY KEY
+);
\ No newline at end of file
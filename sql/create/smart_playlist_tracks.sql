@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS smart_playlist_tracks (
+    playlist_id INTEGER,
+    library_id INTEGER,
+    UNIQUE(playlist_id, library_id),
+    FOREIGN KEY (playlist_id) REFERENCES smart_playlists(id) ON DELETE CASCADE,
+    FOREIGN KEY (library_id) REFERENCES library(id) ON DELETE CASCADE
+);
\ No newline at end of file
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS smart_playlist_tracks_library ON smart_playlist_tracks(library_id);
\ No newline at end of file
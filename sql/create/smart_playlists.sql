@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS smart_playlists (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR UNIQUE,
+    spec VARCHAR,
+    out VARCHAR,
+    version INTEGER,
+    size INTEGER
+);
\ No newline at end of file
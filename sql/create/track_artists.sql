@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS track_artists (
+    library_id INTEGER,
+    artist_id INTEGER,
+    UNIQUE(library_id, artist_id),
+    FOREIGN KEY (library_id) REFERENCES library(id) ON DELETE CASCADE,
+    FOREIGN KEY (artist_id) REFERENCES artists(id) ON DELETE CASCADE
+);
\ No newline at end of file
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS track_artists_artist ON track_artists(artist_id, library_id);
\ No newline at end of file
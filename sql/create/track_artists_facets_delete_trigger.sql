@@ -0,0 +1,34 @@
+CREATE TRIGGER IF NOT EXISTS track_artists_facets_delete
+AFTER DELETE ON track_artists
+BEGIN
+    UPDATE
+        facets
+    SET
+        tracks = tracks - 1,
+        duration = duration - COALESCE(
+            (
+                SELECT
+                    length
+                FROM
+                    library
+                WHERE
+                    id = OLD.library_id
+            ),
+            0
+        )
+    WHERE
+        facet = 'artists'
+        AND value = (
+            SELECT
+                name
+            FROM
+                artists
+            WHERE
+                id = OLD.artist_id
+        );
+    DELETE FROM
+        facets
+    WHERE
+        facet = 'artists'
+        AND tracks <= 0;
+END
\ No newline at end of file
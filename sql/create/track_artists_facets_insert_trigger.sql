@@ -0,0 +1,20 @@
+CREATE TRIGGER IF NOT EXISTS track_artists_facets_insert
+AFTER INSERT ON track_artists
+BEGIN
+    INSERT INTO
+        facets(facet, value, tracks, duration)
+    SELECT
+        'artists',
+        artists.name,
+        1,
+        COALESCE(library.length, 0)
+    FROM
+        artists
+        JOIN library ON library.id = NEW.library_id
+    WHERE
+        artists.id = NEW.artist_id ON CONFLICT(facet, value) DO
+    UPDATE
+    SET
+        tracks = tracks + 1,
+        duration = duration + excluded.duration;
+END
\ No newline at end of file
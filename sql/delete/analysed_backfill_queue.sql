@@ -0,0 +1,11 @@
+DELETE FROM
+    backfill_queue
+WHERE
+    library_id IN (
+        SELECT
+            library_id
+        FROM
+            analysis_import
+        WHERE
+            bpm IS NOT NULL
+    )
\ No newline at end of file
@@ -0,0 +1,12 @@
+DELETE FROM
+    refine_queue
+WHERE
+    library_id IN (
+        SELECT
+            library_id
+        FROM
+            analysis_import
+        WHERE
+            bpm IS NOT NULL
+            AND COALESCE(bpm_confidence, 1.0) >= ?
+    )
\ No newline at end of file
@@ -0,0 +1,9 @@
+DELETE FROM
+    artists
+WHERE
+    id NOT IN (
+        SELECT
+            artist_id
+        FROM
+            track_artists
+    )
\ No newline at end of file
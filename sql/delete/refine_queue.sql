@@ -0,0 +1 @@
+DELETE FROM refine_queue WHERE library_id = ?;
\ No newline at end of file
@@ -0,0 +1,4 @@
+DELETE FROM
+    smart_playlists
+WHERE
+    name = ?
\ No newline at end of file
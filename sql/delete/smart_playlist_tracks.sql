@@ -0,0 +1,5 @@
+DELETE FROM
+    smart_playlist_tracks
+WHERE
+    playlist_id = ?
+    AND library_id = ?
\ No newline at end of file
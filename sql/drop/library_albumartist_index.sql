@@ -0,0 +1 @@
+DROP INDEX IF EXISTS library_albumartist;
\ No newline at end of file
@@ -7,8 +7,10 @@ WITH t AS (
         import.composer,
         import.album,
         import.bpm,
+        import.bpm_confidence,
         import.length,
-        import.year
+        import.year,
+        duplicate_key(import.title, import.albumartist)
     from
         import
 )
@@ -21,8 +23,10 @@ INSERT
         composer,
         album,
         bpm,
+        bpm_confidence,
         length,
-        year
+        year,
+        dup_key
     )
 SELECT
     *
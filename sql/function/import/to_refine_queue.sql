@@ -0,0 +1,9 @@
+INSERT
+    OR IGNORE INTO refine_queue(library_id)
+SELECT
+    library.id
+FROM
+    import
+    JOIN library ON library.path = import.path
+WHERE
+    import.bpm_confidence < ?
\ No newline at end of file
@@ -0,0 +1,29 @@
+WITH RECURSIVE split(path, name, rest) AS (
+    SELECT
+        import.path,
+        '',
+        COALESCE(import.albumartist, '') || ';' || COALESCE(import.artist, '') || ';'
+    FROM
+        import
+    UNION
+    ALL
+    SELECT
+        path,
+        trim(substr(rest, 0, instr(rest, ';'))),
+        substr(rest, instr(rest, ';') + 1)
+    FROM
+        split
+    WHERE
+        rest <> ''
+)
+INSERT
+    OR IGNORE INTO track_artists(library_id, artist_id)
+SELECT
+    DISTINCT library.id,
+    artists.id
+FROM
+    split
+    JOIN library ON library.path = split.path
+    JOIN artists ON artists.name = split.name
+WHERE
+    split.name <> ''
\ No newline at end of file
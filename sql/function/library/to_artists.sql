@@ -0,0 +1,24 @@
+WITH RECURSIVE split(name, rest) AS (
+    SELECT
+        '',
+        COALESCE(library.albumartist, '') || ';' || COALESCE(library.artist, '') || ';'
+    FROM
+        library
+    UNION
+    ALL
+    SELECT
+        trim(substr(rest, 0, instr(rest, ';'))),
+        substr(rest, instr(rest, ';') + 1)
+    FROM
+        split
+    WHERE
+        rest <> ''
+)
+INSERT
+    OR IGNORE INTO artists(name)
+SELECT
+    DISTINCT name
+FROM
+    split
+WHERE
+    name <> ''
\ No newline at end of file
@@ -0,0 +1,65 @@
+INSERT
+    OR REPLACE INTO facets(facet, value, tracks, duration)
+SELECT
+    'albumartists',
+    albumartist,
+    COUNT(*),
+    SUM(COALESCE(length, 0))
+FROM
+    library
+WHERE
+    albumartist IS NOT NULL
+GROUP BY
+    albumartist
+UNION
+ALL
+SELECT
+    'years',
+    year,
+    COUNT(*),
+    SUM(COALESCE(length, 0))
+FROM
+    library
+WHERE
+    year IS NOT NULL
+GROUP BY
+    year
+UNION
+ALL
+SELECT
+    'bpm',
+    CAST(bpm / 10 AS INTEGER) * 10,
+    COUNT(*),
+    SUM(COALESCE(length, 0))
+FROM
+    library
+WHERE
+    bpm IS NOT NULL
+GROUP BY
+    CAST(bpm / 10 AS INTEGER) * 10
+UNION
+ALL
+SELECT
+    'genres',
+    genres.name,
+    COUNT(*),
+    SUM(COALESCE(library.length, 0))
+FROM
+    genre_list
+    JOIN genres ON genres.id = genre_list.genre_id
+    JOIN library ON library.id = genre_list.library_id
+GROUP BY
+    genres.name
+UNION
+ALL
+SELECT
+    'artists',
+    artists.name,
+    COUNT(*),
+    SUM(COALESCE(library.length, 0))
+FROM
+    track_artists
+    JOIN artists ON artists.id = track_artists.artist_id
+    JOIN library ON library.id = track_artists.library_id
+GROUP BY
+    artists.name
\ No newline at end of file
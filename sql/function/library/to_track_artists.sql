@@ -0,0 +1,28 @@
+WITH RECURSIVE split(library_id, name, rest) AS (
+    SELECT
+        library.id,
+        '',
+        COALESCE(library.albumartist, '') || ';' || COALESCE(library.artist, '') || ';'
+    FROM
+        library
+    UNION
+    ALL
+    SELECT
+        library_id,
+        trim(substr(rest, 0, instr(rest, ';'))),
+        substr(rest, instr(rest, ';') + 1)
+    FROM
+        split
+    WHERE
+        rest <> ''
+)
+INSERT
+    OR IGNORE INTO track_artists(library_id, artist_id)
+SELECT
+    DISTINCT split.library_id,
+    artists.id
+FROM
+    split
+    JOIN artists ON artists.name = split.name
+WHERE
+    split.name <> ''
\ No newline at end of file
@@ -0,0 +1,10 @@
+INSERT
+    OR IGNORE INTO tag_queue(library_id)
+SELECT
+    library_id
+FROM
+    analysis_import
+WHERE
+    library_id IS NOT NULL
+    AND bpm IS NOT NULL
+    AND COALESCE(bpm_confidence, 1.0) >= ?
\ No newline at end of file
@@ -0,0 +1,20 @@
+INSERT INTO
+    analysis_import(
+        path,
+        content_hash,
+        bpm,
+        bpm_confidence,
+        loudness,
+        replaygain,
+        energy
+    )
+VALUES
+    (
+        :path,
+        :content_hash,
+        :bpm,
+        :bpm_confidence,
+        :loudness,
+        :replaygain,
+        :energy
+    )
\ No newline at end of file
@@ -0,0 +1,4 @@
+INSERT
+    OR IGNORE INTO feature_failures(library_id)
+VALUES
+    (?)
\ No newline at end of file
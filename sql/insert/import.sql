@@ -9,8 +9,9 @@ INSERT INTO
         artistsort,
         album,
         bpm,
+        bpm_confidence,
         length,
         year
     )
 VALUES
-    (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
\ No newline at end of file
+    (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
\ No newline at end of file
@@ -0,0 +1,4 @@
+INSERT
+    OR IGNORE INTO library_version(id, version)
+VALUES
+    (0, 0)
\ No newline at end of file
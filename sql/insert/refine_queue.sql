@@ -0,0 +1,4 @@
+INSERT
+    OR IGNORE INTO refine_queue(library_id)
+VALUES
+    (?)
\ No newline at end of file
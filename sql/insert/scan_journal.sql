@@ -0,0 +1,4 @@
+INSERT
+    OR IGNORE INTO scan_journal(directory)
+VALUES
+    (?)
\ No newline at end of file
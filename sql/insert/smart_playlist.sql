@@ -0,0 +1,4 @@
+INSERT
+    OR REPLACE INTO smart_playlists(name, spec, out, version, size)
+VALUES
+    (?, ?, ?, -1, 0)
\ No newline at end of file
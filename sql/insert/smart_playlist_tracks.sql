@@ -0,0 +1,4 @@
+INSERT
+    OR IGNORE INTO smart_playlist_tracks(playlist_id, library_id)
+VALUES
+    (?, ?)
\ No newline at end of file
@@ -0,0 +1,4 @@
+INSERT
+    OR IGNORE INTO tag_queue(library_id)
+VALUES
+    (?)
\ No newline at end of file
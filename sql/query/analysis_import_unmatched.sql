@@ -0,0 +1,12 @@
+SELECT
+    path,
+    content_hash,
+    bpm,
+    bpm_confidence,
+    loudness,
+    replaygain,
+    energy
+FROM
+    analysis_import
+WHERE
+    library_id IS NULL
\ No newline at end of file
@@ -0,0 +1,7 @@
+SELECT
+    library.id,
+    library.path,
+    library.length
+FROM
+    backfill_queue
+    JOIN library ON library.id = backfill_queue.library_id
\ No newline at end of file
@@ -0,0 +1,6 @@
+SELECT
+    id
+FROM
+    library
+WHERE
+    changed > ?
\ No newline at end of file
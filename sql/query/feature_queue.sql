@@ -0,0 +1,17 @@
+SELECT
+    library.id,
+    library.path,
+    library.length
+FROM
+    library
+WHERE
+    (
+        library.loudness IS NULL
+        OR library.energy IS NULL
+    )
+    AND library.id NOT IN (
+        SELECT
+            library_id
+        FROM
+            feature_failures
+    )
\ No newline at end of file
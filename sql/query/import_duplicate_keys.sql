@@ -0,0 +1,5 @@
+SELECT
+    DISTINCT library.dup_key
+FROM
+    import
+    JOIN library ON library.path = import.path
\ No newline at end of file
@@ -0,0 +1,4 @@
+SELECT
+    id
+FROM
+    library
\ No newline at end of file
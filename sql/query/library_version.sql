@@ -0,0 +1 @@
+SELECT version FROM library_version;
\ No newline at end of file
@@ -0,0 +1,7 @@
+SELECT
+    library.id,
+    library.path,
+    library.length
+FROM
+    refine_queue
+    JOIN library ON library.id = refine_queue.library_id
\ No newline at end of file
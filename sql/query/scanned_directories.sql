@@ -0,0 +1 @@
+SELECT directory FROM scan_journal;
\ No newline at end of file
@@ -0,0 +1,8 @@
+SELECT
+    genre_list.library_id,
+    genre_list.genre_id
+FROM
+    genre_list
+    JOIN library ON library.id = genre_list.library_id
+WHERE
+    library.changed > ?
\ No newline at end of file
@@ -0,0 +1,10 @@
+SELECT
+    id,
+    bpm,
+    year,
+    length,
+    canonical_id IS NULL OR canonical_id = id
+FROM
+    library
+WHERE
+    changed > ?
\ No newline at end of file
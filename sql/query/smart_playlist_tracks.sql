@@ -0,0 +1,8 @@
+SELECT
+    library_id
+FROM
+    smart_playlist_tracks
+WHERE
+    playlist_id = ?
+ORDER BY
+    library_id
\ No newline at end of file
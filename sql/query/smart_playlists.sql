@@ -0,0 +1,11 @@
+SELECT
+    id,
+    name,
+    spec,
+    out,
+    version,
+    size
+FROM
+    smart_playlists
+ORDER BY
+    name
\ No newline at end of file
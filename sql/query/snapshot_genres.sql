@@ -0,0 +1,6 @@
+SELECT
+    genre_list.library_id,
+    genres.name
+FROM
+    genre_list
+    JOIN genres ON genres.id = genre_list.genre_id
\ No newline at end of file
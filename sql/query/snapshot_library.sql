@@ -0,0 +1,14 @@
+SELECT
+    id,
+    path,
+    title,
+    albumartist,
+    artist,
+    album,
+    bpm,
+    length,
+    year
+FROM
+    library
+ORDER BY
+    id
\ No newline at end of file
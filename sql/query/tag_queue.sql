@@ -0,0 +1,9 @@
+SELECT
+    library.id,
+    library.path,
+    library.bpm
+FROM
+    tag_queue
+    JOIN library ON library.id = tag_queue.library_id
+WHERE
+    library.bpm IS NOT NULL
\ No newline at end of file
@@ -0,0 +1,7 @@
+SELECT
+    id,
+    path
+FROM
+    library
+WHERE
+    content_hash IS NULL
\ No newline at end of file
@@ -0,0 +1 @@
+DELETE FROM analysis_import;
\ No newline at end of file
@@ -0,0 +1 @@
+DELETE FROM scan_journal;
\ No newline at end of file
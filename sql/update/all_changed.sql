@@ -0,0 +1,4 @@
+UPDATE
+    library
+SET
+    changed = 0
\ No newline at end of file
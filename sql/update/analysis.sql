@@ -0,0 +1,15 @@
+UPDATE
+    library
+SET
+    bpm = COALESCE(analysis_import.bpm, library.bpm),
+    bpm_confidence = CASE
+        WHEN analysis_import.bpm IS NULL THEN library.bpm_confidence
+        ELSE COALESCE(analysis_import.bpm_confidence, 1.0)
+    END,
+    loudness = COALESCE(analysis_import.loudness, library.loudness),
+    replaygain = COALESCE(analysis_import.replaygain, library.replaygain),
+    energy = COALESCE(analysis_import.energy, library.energy)
+FROM
+    analysis_import
+WHERE
+    library.id = analysis_import.library_id
\ No newline at end of file
@@ -0,0 +1,9 @@
+UPDATE
+    analysis_import
+SET
+    library_id = library.id
+FROM
+    library
+WHERE
+    analysis_import.library_id IS NULL
+    AND library.content_hash = analysis_import.content_hash
\ No newline at end of file
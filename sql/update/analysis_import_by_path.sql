@@ -0,0 +1,8 @@
+UPDATE
+    analysis_import
+SET
+    library_id = library.id
+FROM
+    library
+WHERE
+    library.path = analysis_import.path
\ No newline at end of file
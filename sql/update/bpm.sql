@@ -0,0 +1,10 @@
+UPDATE
+    library
+SET
+    bpm = COALESCE(:bpm, bpm),
+    bpm_confidence = CASE
+        WHEN :bpm IS NULL THEN bpm_confidence
+        ELSE :confidence
+    END
+WHERE
+    id = :id
\ No newline at end of file
@@ -0,0 +1,19 @@
+UPDATE
+    library
+SET
+    canonical_id = (
+        SELECT
+            l.id
+        FROM
+            library AS l
+        WHERE
+            l.dup_key = library.dup_key
+            AND same_length(l.length, library.length)
+        ORDER BY
+            l.path LIKE '%.flac' DESC,
+            l.id
+        LIMIT
+            1
+    )
+WHERE
+    dup_key = ?
\ No newline at end of file
@@ -0,0 +1,6 @@
+UPDATE
+    library
+SET
+    content_hash = ?
+WHERE
+    id = ?
\ No newline at end of file
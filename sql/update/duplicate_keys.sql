@@ -0,0 +1,4 @@
+UPDATE
+    library
+SET
+    dup_key = duplicate_key(title, albumartist)
\ No newline at end of file
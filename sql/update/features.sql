@@ -0,0 +1,9 @@
+UPDATE
+    library
+SET
+    length = COALESCE(:length, length),
+    loudness = COALESCE(:loudness, loudness),
+    replaygain = COALESCE(:replaygain, replaygain),
+    energy = COALESCE(:energy, energy)
+WHERE
+    id = :id
\ No newline at end of file
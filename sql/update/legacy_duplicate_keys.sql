@@ -0,0 +1,6 @@
+UPDATE
+    library
+SET
+    dup_key = duplicate_key(title, albumartist)
+WHERE
+    dup_key LIKE '%|%|%'
\ No newline at end of file
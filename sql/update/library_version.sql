@@ -0,0 +1 @@
+UPDATE library_version SET version = version + 1;
\ No newline at end of file
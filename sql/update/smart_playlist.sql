@@ -0,0 +1,14 @@
+UPDATE
+    smart_playlists
+SET
+    version = ?,
+    size = (
+        SELECT
+            COUNT(*)
+        FROM
+            smart_playlist_tracks
+        WHERE
+            playlist_id = smart_playlists.id
+    )
+WHERE
+    id = ?
\ No newline at end of file